@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Benchmark EngineRequest response parsing and request overhead.
+
+Usage:
+    python benchmarks/bench_engine.py [--seconds 0.5] [--repeat 5] [--only PATTERN]
+                                      [--output results.json] [--compare baseline.json]
+
+Parsing is timed on synthetic engine xml of several sizes through
+parse_response, the lazy EngineResponse and the raw_response path.
+Round trips are timed through make_request against an in process
+simulated engine, so they measure client and transport overhead only.
+
+Results are written as json with --output; --compare prints the change
+against an earlier results file.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from regressions_test.connection_pool import ConnectionPool
+from regressions_test.engine_request import EngineRequest
+from regressions_test.simulator import SimulatedEngine, build_response
+
+
+# name: build_response kwargs
+DOCUMENTS = [
+    ('init', {}),
+    ('faqs_10', {'faqs': 10}),
+    ('faqs_100', {'faqs': 100}),
+    ('faqs_1000', {'faqs': 1000}),
+    ('connectors_1000', {'connector_count': 1000}),
+    ('options_1000', {'options': 1000}),
+]
+
+
+def measure(func, seconds, repeat):
+    """Time func in repeat rounds of about seconds each.
+
+    :return: dict with the number of calls, and the min, median and mean
+    time per call in microseconds across rounds
+    """
+    # Calls per round, sized so a round takes about seconds
+    start = time.time()
+    func()
+    number = max(1, int(seconds / max(time.time() - start, 1e-6)))
+
+    rounds = []
+    for _ in range(repeat):
+        start = time.time()
+        for _ in range(number):
+            func()
+        rounds.append((time.time() - start) / number * 1e6)
+
+    rounds.sort()
+    return {
+        'calls': number * repeat,
+        'min_us': rounds[0],
+        'median_us': rounds[len(rounds) // 2],
+        'mean_us': sum(rounds) / len(rounds)
+    }
+
+
+def parse_benchmarks():
+    """(name, callable) for every parsing benchmark."""
+    engine = EngineRequest('http://127.0.0.1/bot.htm')
+    benchmarks = []
+    for name, kwargs in DOCUMENTS:
+        document = build_response(**kwargs)
+
+        def lazy(document=document):
+            # Reading one field is the usual case for lazy responses
+            engine.parse_response(document, lazy=True).get('botanswer')
+
+        benchmarks.extend([
+            ('parse/%s' % name, lambda document=document: engine.parse_response(document)),
+            ('lazy/%s' % name, lazy),
+            ('raw/%s' % name, lambda document=document: list(engine.parser.iter_elements(document))),
+        ])
+    return benchmarks
+
+
+def request_benchmarks(url, pool):
+    """(name, callable) for every make_request round trip benchmark."""
+    engine = EngineRequest(url, pool=pool)
+    ident = engine.make_request()['ident']
+    entry = {'ident': ident, 'entry': 'billing'}
+
+    def new_connection():
+        fresh = ConnectionPool()
+        EngineRequest(url, pool=fresh).make_request(dict(entry))
+        fresh.close()
+
+    return [
+        ('request/init', lambda: engine.make_request()),
+        ('request/entry', lambda: engine.make_request(dict(entry))),
+        ('request/entry_raw', lambda: list(engine.make_request(dict(entry), raw_response=True))),
+        ('request/entry_ignored', lambda: engine.make_request(dict(entry), ignore_response=True)),
+        ('request/entry_new_connection', new_connection),
+        ('request/close', lambda: engine.end_session(ident)),
+    ]
+
+
+def compare(results, baseline):
+    """Print the median time change of every benchmark found in both runs."""
+    print '\n%-36s %12s %12s %9s' % ('BENCHMARK', 'BASE US', 'NOW US', 'CHANGE')
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        before = baseline[name]['median_us']
+        now = results[name]['median_us']
+        print '%-36s %12.1f %12.1f %+8.1f%%' % (name, before, now, (now - before) / before * 100)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--seconds', type=float, default=0.5, help='Time spent on each round.')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='Rounds per benchmark.')
+    arg_parser.add_argument('--only', default='', help='Only run benchmarks whose name contains this.')
+    arg_parser.add_argument('--output', help='Write results to this json file.')
+    arg_parser.add_argument('--compare', help='Results file of an earlier run to compare against.')
+    args = arg_parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    engine = SimulatedEngine()
+    url = engine.start()
+    pool = ConnectionPool()
+
+    results = {}
+    try:
+        print '%-36s %10s %12s %12s' % ('BENCHMARK', 'CALLS', 'MEDIAN US', 'MIN US')
+        for name, func in parse_benchmarks() + request_benchmarks(url, pool):
+            if args.only not in name:
+                continue
+            results[name] = measure(func, args.seconds, args.repeat)
+            print '%-36s %10d %12.1f %12.1f' % (name, results[name]['calls'],
+                                                results[name]['median_us'], results[name]['min_us'])
+    finally:
+        pool.close()
+        engine.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'seconds': args.seconds,
+                       'repeat': args.repeat,
+                       'results': results}, f, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        compare(results, baseline)
+
+
+if __name__ == '__main__':
+    main()
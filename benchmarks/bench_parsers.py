@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Compare parse_response throughput of every available parser backend.
+
+Usage:
+    python benchmarks/bench_parsers.py [--faqs 10 100 1000] [--seconds 1]
+
+Every backend's output is checked against the elementtree backend before it
+is timed.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from regressions_test.parsers import PARSERS, get_parser
+from regressions_test.simulator import build_response
+
+
+def bench(parser, response, seconds):
+    """Parse response repeatedly for about seconds.
+
+    :rtype: float; responses parsed per second
+    """
+    count = 0
+    start = time.time()
+    while True:
+        for _ in range(10):
+            parser.parse(response)
+        count += 10
+        elapsed = time.time() - start
+        if elapsed >= seconds:
+            return count / elapsed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--faqs', type=int, nargs='+', default=[0, 10, 100, 1000],
+                            help='Number of semanticfaqs in each benchmarked response.')
+    arg_parser.add_argument('--seconds', type=float, default=1.0, help='Time spent on each measurement.')
+    args = arg_parser.parse_args()
+
+    reference = get_parser('elementtree')
+    names = sorted(PARSERS)
+
+    print '%-8s %-10s' % ('FAQS', 'KB') + ''.join('%16s' % n for n in names)
+    for faqs in args.faqs:
+        response = build_response(faqs=faqs, connector_count=faqs // 10, options=faqs // 10)
+        expected = reference.parse(response)
+
+        rates = []
+        for name in names:
+            parser = get_parser(name)
+            assert parser.parse(response) == expected, '%s output differs from elementtree' % name
+            rates.append(bench(parser, response, args.seconds))
+
+        print '%-8d %-10.1f' % (faqs, len(response) / 1024.0) + ''.join('%14.0f/s' % r for r in rates)
+
+
+if __name__ == '__main__':
+    main()
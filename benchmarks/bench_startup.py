@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+Benchmark regressions_test command startup time.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 10] [--only PATTERN]
+                                       [--output results.json] [--compare baseline.json]
+
+Every command is run in a fresh interpreter, the way scripts call it,
+and timed from process start to exit. Interpreter startup alone is
+reported as "python" so it can be told apart from the cost of the
+package. Commands that change a config run against a throwaway project
+that is removed afterwards.
+
+The heavy modules each command imported are listed, so a command that
+starts pulling in pytest or the engine client again shows up here.
+
+Results are written as json with --output; --compare prints the change
+against an earlier results file.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from regressions_test.registry import default_registry as registry
+
+
+PROJECT = 'bench_startup'
+
+# name: command line arguments
+COMMANDS = [
+    ('python', None),
+    ('--version', ['--version']),
+    ('list_projects', ['list_projects']),
+    ('show', ['show', PROJECT, 'endpoints']),
+    ('add_endpoint', ['add_endpoint', PROJECT, 'bench', 'http://127.0.0.1/bot.htm']),
+    ('update_version', ['update_version', PROJECT, '1']),
+    ('test --help', ['test', '--help']),
+]
+
+# Modules that shouldn't be imported by commands that only touch configs
+HEAVY_MODULES = ('pytest', 'urllib2', 'sqlite3', 'regressions_test.engine_request')
+
+# Runs a command and reports the heavy modules it imported on stderr
+BOOTSTRAP = """
+import atexit, sys
+atexit.register(lambda: sys.stderr.write('\\nIMPORTED %s\\n' % ','.join(
+    m for m in {heavy!r} if sys.modules.get(m) is not None)))
+sys.argv[0] = 'regressions_test'
+from regressions_test.regressions_test import main
+main()
+"""
+
+
+def run(argv):
+    """Run a command in a new interpreter.
+
+    :return: seconds taken, and the heavy modules imported
+        :rtype: tuple; (float, list)
+    """
+    if argv is None:
+        command = [sys.executable, '-c', 'pass']
+    else:
+        command = [sys.executable, '-c', BOOTSTRAP.format(heavy=HEAVY_MODULES)] + argv
+
+    start = time.time()
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = process.communicate()
+    elapsed = time.time() - start
+
+    imported = []
+    for line in err.splitlines():
+        if line.startswith('IMPORTED '):
+            imported = [m for m in line[len('IMPORTED '):].split(',') if m]
+    return elapsed, imported
+
+
+def measure(argv, repeat):
+    """Time a command repeat times.
+
+    :return: dict with the min, median and mean time in milliseconds, and
+    the heavy modules imported
+    """
+    times = []
+    imported = []
+    for _ in range(repeat):
+        elapsed, imported = run(argv)
+        times.append(elapsed * 1000)
+
+    times.sort()
+    return {
+        'runs': repeat,
+        'min_ms': times[0],
+        'median_ms': times[len(times) // 2],
+        'mean_ms': sum(times) / len(times),
+        'imported': imported
+    }
+
+
+def compare(results, baseline):
+    """Print the median time change of every command found in both runs."""
+    print '\n%-20s %10s %10s %9s' % ('COMMAND', 'BASE MS', 'NOW MS', 'CHANGE')
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        before = baseline[name]['median_ms']
+        now = results[name]['median_ms']
+        print '%-20s %10.1f %10.1f %+8.1f%%' % (name, before, now, (now - before) / before * 100)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--repeat', type=int, default=10, help='Runs per command.')
+    arg_parser.add_argument('--only', default='', help='Only run commands whose name contains this.')
+    arg_parser.add_argument('--output', help='Write results to this json file.')
+    arg_parser.add_argument('--compare', help='Results file of an earlier run to compare against.')
+    args = arg_parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    if registry.exists(PROJECT):
+        sys.exit('A project named %s already exists' % PROJECT)
+    registry.save(PROJECT, {'name': PROJECT, 'version_number': '1', 'endpoints': {}})
+
+    results = {}
+    try:
+        print '%-20s %10s %10s  %s' % ('COMMAND', 'MEDIAN MS', 'MIN MS', 'HEAVY IMPORTS')
+        for name, argv in COMMANDS:
+            if args.only not in name:
+                continue
+            results[name] = measure(argv, args.repeat)
+            print '%-20s %10.1f %10.1f  %s' % (name, results[name]['median_ms'], results[name]['min_ms'],
+                                               ', '.join(results[name]['imported']) or '-')
+    finally:
+        os.remove(registry.path_for(PROJECT))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'repeat': args.repeat,
+                       'results': results}, f, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        compare(results, baseline)
+
+
+if __name__ == '__main__':
+    main()
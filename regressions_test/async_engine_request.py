@@ -0,0 +1,137 @@
+import atexit
+from multiprocessing.pool import ThreadPool
+from connection_pool import ConnectionPool
+from engine_request import EngineRequest, SessionResults
+
+
+# Worker pools of AsyncEngineRequests that weren't closed; like the sessions
+# of engine_request.default_tracker, they are closed when the process exits
+_open_pools = set()
+
+
+def _close_pools():
+    for workers in list(_open_pools):
+        _open_pools.discard(workers)
+        workers.close()
+        workers.join()
+
+
+atexit.register(_close_pools)
+
+
+class _Result(object):
+    def __init__(self, async_result, transform):
+        """Wrap a pool AsyncResult, applying transform to its value.
+
+        :param async_result: multiprocessing.pool.AsyncResult
+        :param transform: callable applied to the value returned by get()
+        """
+        self._async_result = async_result
+        self._transform = transform
+
+    def ready(self):
+        return self._async_result.ready()
+
+    def successful(self):
+        return self._async_result.successful()
+
+    def wait(self, timeout=None):
+        self._async_result.wait(timeout)
+
+    def get(self, timeout=None):
+        return self._transform(self._async_result.get(timeout))
+
+
+class AsyncEngineRequest(object):
+    def __init__(self, endpoint, project=None, pool=None, workers=32):
+        """Non-blocking counterpart of EngineRequest.
+
+        Every request method returns immediately with a result object;
+        call .get() on it to wait for the value the matching EngineRequest
+        method would have returned. Requests run on a pool of worker
+        threads so many engine sessions can be driven from one process.
+        Use it as a context manager, or call close(), to stop them; any
+        still running are stopped when the process exits.
+
+        :param endpoint: http url endpoint where requests will be made
+            :type endpoint: str
+
+        :param project: the projects name. See EngineRequest.
+            :type project: str
+
+        :param pool: keep-alive connection pool. Defaults to a new pool
+        sized to hold one connection per worker.
+            :type pool: ConnectionPool
+
+        :param workers: max number of requests in flight at once
+            :type workers: int
+        """
+        if pool is None:
+            pool = ConnectionPool(maxsize=workers)
+
+        self.engine = EngineRequest(endpoint, project=project, pool=pool)
+        self.endpoint = endpoint
+        self.project = project
+        self.pool = pool
+        self._workers = ThreadPool(workers)
+        _open_pools.add(self._workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def parse_response(self, response):
+        """Same output as EngineRequest.parse_response.
+
+        :param response: str
+        :rtype: dict
+        """
+        return self.engine.parse_response(response)
+
+    def make_request(self, params=None, ignore_response=False, raw_response=False):
+        """Queue a request to the endpoint. See EngineRequest.make_request.
+
+        :rtype: AsyncResult; get() returns dict | iterator | None
+        """
+        return self._workers.apply_async(self.engine.make_request,
+                                         (params, ignore_response, raw_response))
+
+    def end_session(self, session_id):
+        """Queue an "end session" request.
+
+        :param session_id: str
+        :rtype: AsyncResult; get() returns bool
+        """
+        return self._workers.apply_async(self.engine.end_session, (session_id,))
+
+    def end_multiple_sessions(self, session_ids):
+        """Queue "end session" requests for every session id. They are sent
+        concurrently.
+
+        :param session_ids: list of session IDs to close
+            :type session_ids: list
+
+        :rtype: result object; get() returns SessionResults
+        """
+        results = self._workers.map_async(self.engine.close_session, session_ids)
+        return _Result(results, SessionResults)
+
+    def open_new_sessions(self, number_of_sessions=1):
+        """Open x number of sessions concurrently.
+
+        :param number_of_sessions: optional param to dictate how many
+            sessions should be created
+
+        :rtype: result object; get() returns SessionResults
+        """
+        results = self._workers.map_async(lambda _: self.engine.open_session(),
+                                          range(number_of_sessions))
+        return _Result(results, SessionResults)
+
+    def close(self):
+        """Wait for queued requests, then stop the worker threads."""
+        _open_pools.discard(self._workers)
+        self._workers.close()
+        self._workers.join()
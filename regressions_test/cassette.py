@@ -0,0 +1,145 @@
+import gzip
+import json
+import os
+import threading
+import urllib
+import urlparse
+from connection_pool import PooledResponse, default_pool
+
+
+CASSETTE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cassettes')
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+# Cassettes already loaded in this process, by path
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+
+class CassetteError(Exception):
+    pass
+
+
+def path_for(project, environment):
+    """Cassette file for a project's environment.
+
+    :rtype: str
+    """
+    name = '%s_%s.json.gz' % (project.lower().replace(' ', '_'), environment)
+    return os.path.join(CASSETTE_DIRECTORY, name)
+
+
+def load(path, mode):
+    """Return the cassette for path, opening it once per process so the
+    INIT request made by test() and the pytest run share one recording.
+
+    :param path: str; cassette file
+    :param mode: RECORD | REPLAY
+    :rtype: Cassette
+    """
+    with _cassettes_lock:
+        cassette = _cassettes.get(path)
+        if cassette is None or cassette.mode != mode:
+            cassette = _cassettes[path] = Cassette(path, mode)
+        return cassette
+
+
+class Cassette(object):
+    def __init__(self, path, mode, pool=None):
+        """Stand in for a ConnectionPool that records engine traffic, or
+        replays it without touching the network.
+
+        Interactions are matched on method, url and form params, ignoring
+        the session ident. Repeated requests are replayed in the order they
+        were recorded. The recorded ident in a replayed response is swapped
+        for the ident of the request, so any session replays any recording.
+
+        :param path: str; cassette file
+        :param mode: RECORD | REPLAY
+        :param pool: ConnectionPool used while recording
+        """
+        if mode not in (RECORD, REPLAY):
+            raise ValueError('Cassette mode must be "%s" or "%s"' % (RECORD, REPLAY))
+
+        self.path = path
+        self.mode = mode
+        self.pool = pool if pool is not None else default_pool
+
+        self._lock = threading.Lock()
+        self._interactions = {}
+        self._played = {}
+
+        if mode == REPLAY:
+            if not os.path.exists(path):
+                raise CassetteError('No cassette recorded at %s. Run with --record first.' % path)
+            with gzip.open(path, 'rb') as f:
+                self._interactions = json.loads(f.read())['interactions']
+
+    @staticmethod
+    def _key(method, url, body):
+        """Match key and session ident of a request.
+
+        :rtype: tuple; (key, ident)
+        """
+        params = urlparse.parse_qsl(body or '', keep_blank_values=True)
+        ident = dict(params).get('ident', '')
+        params = sorted(p for p in params if p[0] != 'ident')
+        return '%s %s?%s' % (method, url, urllib.urlencode(params)), ident
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        """Same interface as ConnectionPool.request.
+
+        :rtype: PooledResponse
+        """
+        key, ident = self._key(method, url, body)
+
+        if self.mode == RECORD:
+            response = self.pool.request(method, url, body, headers, timeout)
+            with self._lock:
+                # latin-1 maps every byte to one character, so bodies in any
+                # encoding survive the trip through json
+                self._interactions.setdefault(key, []).append(
+                    [ident, response.status, response.reason, response.body.decode('latin-1')])
+            return response
+
+        with self._lock:
+            recorded = self._interactions.get(key)
+            if not recorded:
+                raise CassetteError('No recorded response for %s' % key)
+            played = self._played.get(key, 0)
+            self._played[key] = played + 1
+
+        # Once every recording was played, start over
+        recorded_ident, status, reason, data = recorded[played % len(recorded)]
+        data = data.encode('latin-1')
+        if recorded_ident and ident and recorded_ident != ident:
+            data = data.replace(recorded_ident.encode('latin-1'), ident)
+
+        return PooledResponse(status, reason, {}, data)
+
+    def save(self):
+        """Write recorded interactions to the cassette file."""
+        if self.mode != RECORD:
+            return
+
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with self._lock:
+            payload = json.dumps({'version': 1, 'interactions': self._interactions},
+                                 separators=(',', ':'), sort_keys=True)
+
+        tmp = '%s.tmp' % self.path
+        with gzip.open(tmp, 'wb') as f:
+            f.write(payload)
+        os.rename(tmp, self.path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'interactions': sum(len(v) for v in self._interactions.values()),
+                'replayed': sum(self._played.values())
+            }
@@ -1,41 +1,263 @@
 import pytest
-import json
-import os
-from engine_request import EngineRequest
+import cassette as cassettes
+from engine_request import DEFAULT_TIMEOUT, EngineRequest, default_tracker
+from fingerprints import ChangedOnly
+from history import HistoryRecorder
+from registry import default_registry as registry
+from resilience import Deadline, RetryPolicy
+from response_cache import ResponseCache
+from scenarios import run_scenarios, scenario_names
+from results import TimingCollector
+from session_pool import SessionPool
+from sharding import Shard
+from targets import applies_to, parse_target, target_of, targets_for
 
 
 def pytest_addoption(parser):
-    parser.addoption('--project', action='store')
-    parser.addoption('--environment', action='store')
-    parser.addoption("--params", action="store", default='{"params":"", "entry":""}')
+    parser.addoption('--target', action='append', default=[], metavar='PROJECT:ENVIRONMENT',
+                     help='Project environment the tests run against. Repeatable; every test runs once per '
+                          'target, and the fixtures of each target are set up once.')
+    parser.addoption('--exclude-target', action='append', default=[], metavar='PROJECT:ENVIRONMENT',
+                     help='Target whose tests are deselected, after tests are split into shards.')
+    parser.addoption('--project', action='store', help='Project of a single target; see --target.')
+    parser.addoption('--environment', action='store', help='Environment of a single target; see --target.')
+    parser.addoption('--session-pool-size', action='store', type=int, default=4,
+                     help='Number of engine sessions opened at once for the session fixture.')
+    parser.addoption('--session-max-age', action='store', type=int, default=300,
+                     help='Seconds before an unused pooled session is replaced.')
+    parser.addoption('--record', action='store_true',
+                     help='Record engine responses to the project and environment cassette.')
+    parser.addoption('--replay', action='store_true',
+                     help='Serve engine responses from the recorded cassette instead of the engine.')
+    parser.addoption('--response-cache', action='store_true',
+                     help='Let tests serve requests that cannot change within a kb version from the response cache.')
+    parser.addoption('--cache-ttl', action='store', type=int, default=24 * 60 * 60,
+                     help='Seconds a cached response stays valid.')
+    parser.addoption('--scenario-concurrency', action='store', type=int, default=8,
+                     help='Number of config scenarios run at the same time.')
+    parser.addoption('--changed-only', action='store_true',
+                     help='Only run tests whose config values, endpoint, kb version or source changed '
+                          'since they last passed.')
+    parser.addoption('--engine-timeout', action='store', type=float, default=DEFAULT_TIMEOUT,
+                     help='Seconds an engine connect or read may take before the request fails.')
+    parser.addoption('--engine-retries', action='store', type=int, default=2,
+                     help='Retries of INIT and session close requests after engine failures.')
+    parser.addoption('--deadline', action='store', type=float, default=None,
+                     help='Seconds the whole run may spend on engine requests; later requests fail fast.')
+    parser.addoption('--shard-index', action='store', type=int, default=0,
+                     help='Shard of the tests to run, from 0 to --shard-count - 1.')
+    parser.addoption('--shard-count', action='store', type=int, default=1,
+                     help='Number of shards the tests are split into, balanced by stored test durations.')
+    parser.addoption('--timings-file', action='store', default=None,
+                     help='Json file engine request timings of every target are written to. '
+                          'Defaults to timings/<project>_<environment>.json per target.')
+    parser.addoption('--slowest', action='store', type=int, default=10,
+                     help='Number of slowest engine transactions listed after the run.')
+    parser.addoption('--no-history', action='store_true',
+                     help="Don't record the run in the local test history.")
+
+
+def pytest_configure(config):
+    targets = targets_for(config)
+    timings = TimingCollector(config.getoption('timings_file'), config.getoption('slowest'), targets)
+    config.pluginmanager.register(timings, 'engine_timings')
+
+    # With xdist each worker records the targets it ran; the controller
+    # sends no engine requests, so it has no timings to record
+    controller = getattr(config.option, 'numprocesses', None) and not hasattr(config, 'workerinput')
+    if targets and not config.getoption('no_history') and not controller:
+        shard = None
+        if config.getoption('shard_count') > 1:
+            shard = '%d/%d' % (config.getoption('shard_index'), config.getoption('shard_count'))
+        config.pluginmanager.register(HistoryRecorder(targets, timings, registry, shard=shard), 'history')
+
+    if targets:
+        config.pluginmanager.register(ChangedOnly(targets, changed_only=config.getoption('changed_only')),
+                                      'changed_only')
+
+    if config.getoption('shard_count') > 1:
+        config.pluginmanager.register(Shard(config.getoption('shard_index'), config.getoption('shard_count')),
+                                      'shard')
+
+
+# Last, once session fixtures closed the sessions they own
+@pytest.hookimpl(trylast=True)
+def pytest_sessionfinish(session, exitstatus):
+    # Sessions tests opened and didn't close, even when they failed
+    session.config._leaked_sessions = default_tracker.close_all()
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    leaked = getattr(config, '_leaked_sessions', None)
+    if leaked:
+        terminalreporter.write_line('Engine sessions left open by tests and closed at teardown: %d; failed to close: %d'
+                                    % (len(leaked), len(leaked.failures)))
+
+
+def pytest_collection_modifyitems(session, config, items):
+    # Targets that couldn't be tested; deselected after sharding, so every
+    # shard splits the same tests whichever endpoints it could reach
+    excluded = [parse_target(t) for t in config.getoption('exclude_target')]
+    if not excluded:
+        return
+
+    selected, deselected = [], []
+    for item in items:
+        target = getattr(getattr(item, 'callspec', None), 'params', {}).get('target')
+        if target in excluded:
+            deselected.append(item)
+        else:
+            selected.append(item)
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+
+
+def pytest_generate_tests(metafunc):
+    # One test per target; session scoped, so pytest groups each target's
+    # tests and sets its fixtures up once
+    if 'target' not in metafunc.fixturenames:
+        return
+    targets = [t for t in targets_for(metafunc.config) if applies_to(metafunc.module.__file__, t.project)]
+
+    if 'scenario' not in metafunc.fixturenames:
+        metafunc.parametrize('target', targets, ids=[t.id for t in targets], indirect=True, scope='session')
+        return
+
+    # One test per scenario in each target's project config
+    values, ids = [], []
+    for target in targets:
+        try:
+            names = scenario_names(registry.load(target.project).get('scenarios', []))
+        except ValueError, e:
+            pytest.fail('%s: %s' % (target.project, e), pytrace=False)
+        for name in names or [None]:
+            values.append((target, name))
+            ids.append('%s-%s' % (target.id, name or 'no-scenarios'))
+    metafunc.parametrize(['target', 'scenario'], values, ids=ids, indirect=['target'], scope='session')
+
+
+@pytest.hookimpl(tryfirst=True, optionalhook=True)
+def pytest_xdist_make_scheduler(config, log):
+    """With pytest-xdist and --dist=loadscope, hand tests to workers a
+    target at a time, so a target's sessions are only opened on one worker."""
+    if config.getoption('dist') != 'loadscope':
+        return None
+
+    from xdist.scheduler import LoadScopeScheduling
+    targets = targets_for(config)
+
+    class TargetScheduling(LoadScopeScheduling):
+        def _split_scope(self, nodeid):
+            target = target_of(nodeid, targets)
+            if target is None:
+                return LoadScopeScheduling._split_scope(self, nodeid)
+            return target.id
+
+    return TargetScheduling(config, log)
+
+
+@pytest.fixture(scope='session')
+def target(request):
+    """Target the test runs against."""
+    return request.param
+
+
+@pytest.fixture(scope='session')
+def project_config(target):
+    return registry.load(target.project)
+
+
+@pytest.fixture(scope='session')
+def endpoint(project_config, target):
+    return project_config['endpoints'][target.environment]
+
+
+@pytest.fixture(scope='session')
+def cassette(project_config, target, request):
+    """Cassette engine requests go through with --record/--replay, else None."""
+    if request.config.getoption('record'):
+        mode = cassettes.RECORD
+    elif request.config.getoption('replay'):
+        mode = cassettes.REPLAY
+    else:
+        yield None
+        return
+
+    path = cassettes.path_for(project_config['name'], target.environment)
+    c = cassettes.load(path, mode)
+    yield c
+    c.save()
+
+
+@pytest.fixture(scope='session')
+def response_cache(request):
+    """ResponseCache with --response-cache, else None."""
+    if not request.config.getoption('response_cache'):
+        yield None
+        return
+
+    cache = ResponseCache(ttl=request.config.getoption('cache_ttl'))
+    yield cache
+    cache.close()
+
+
+@pytest.fixture(scope='session')
+def deadline(request):
+    """Deadline shared by every engine request with --deadline, else None."""
+    seconds = request.config.getoption('deadline')
+    return Deadline(seconds) if seconds else None
+
+
+@pytest.fixture(scope='session')
+def engine(endpoint, cassette, response_cache, deadline, project_config, request):
+    return EngineRequest(endpoint=endpoint, pool=cassette, cache=response_cache,
+                         version_number=project_config.get('version_number'),
+                         timeout=request.config.getoption('engine_timeout'),
+                         retry=RetryPolicy(request.config.getoption('engine_retries')),
+                         deadline=deadline)
+
+
+@pytest.fixture(scope='session')
+def session_pool(engine, request):
+    pool = SessionPool(engine,
+                       size=request.config.getoption('session_pool_size'),
+                       max_age=request.config.getoption('session_max_age'))
+    pool.fill()
+    yield pool
+    pool.close()
+
 
+@pytest.fixture(scope='session')
+def shared_session(engine):
+    """Ident of the engine session shared by the tests that take params."""
+    session = engine.open_session()
+    if not session:
+        raise RuntimeError('Could not open an engine session: %s' % session.error)
+    yield session.ident
+    engine.close_session(session.ident)
 
 
 @pytest.fixture
-def params(request):
-    return json.loads(request.config.getoption("--params"))
+def params(shared_session):
+    return {'ident': shared_session, 'entry': ''}
 
 
 @pytest.fixture
-def project_config(request):
-    p = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'project_configs', '%s.json' % request.config.getoption('project').lower())
-    config = json.loads(open(p).read())
-    return config
-
-
-@pytest.fixture
-def endpoint(project_config, request):
-    return project_config['endpoints'][request.config.getoption('environment')]
-
-
-@pytest.fixture
-def engine(endpoint):
-    return EngineRequest(endpoint=endpoint)
-
-
-@pytest.fixture
-def session(project_config, engine, params):
-    return engine.make_request(params)
+def session(session_pool):
+    """INIT response of a fresh engine session taken from the pool."""
+    return session_pool.acquire()
+
+
+@pytest.fixture(scope='session')
+def scenario_results(engine, project_config, request):
+    """Results of every config scenario by name. All scenarios run at once
+    the first time a scenario test needs them."""
+    scenarios = project_config.get('scenarios', [])
+    for scenario, name in zip(scenarios, scenario_names(scenarios)):
+        scenario['name'] = name
+    results = run_scenarios(engine, scenarios, request.config.getoption('scenario_concurrency'))
+    return dict((r.name, r) for r in results)
 
 
 @pytest.fixture
@@ -0,0 +1,196 @@
+import errno
+import httplib
+import socket
+import threading
+import time
+import urlparse
+from collections import namedtuple
+
+
+class PooledResponse(namedtuple('PooledResponse', 'status reason headers body timings')):
+    """Response read by ConnectionPool.request.
+
+    timings is a dict of seconds spent on "connect" (0 for a reused
+    connection), "ttfb" (sending the request until the status line and
+    headers were read) and "download" (reading the body), or None for
+    responses that didn't come from the network.
+    """
+    __slots__ = ()
+
+    def __new__(cls, status, reason, headers, body, timings=None):
+        return super(PooledResponse, cls).__new__(cls, status, reason, headers, body, timings)
+
+
+# Errors sending over a keep-alive socket the server closed while it sat idle
+STALE_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+
+def _is_stale(error, sending):
+    """True if error means a reused connection was closed by the server
+    before it saw the request, so the request can safely be sent again:
+    a reset or broken pipe while sending, or the connection closing
+    without a single byte of response. Timeouts never are.
+
+    :param error: httplib.HTTPException | socket.error
+    :param sending: bool; the error was raised while sending the request
+    :rtype: bool
+    """
+    if isinstance(error, socket.timeout):
+        return False
+    if isinstance(error, httplib.BadStatusLine):
+        # httplib reports an empty status line as "''"
+        return error.line in ('', "''")
+    return sending and isinstance(error, socket.error) and error.errno in STALE_ERRNOS
+
+
+class ConnectionPool(object):
+    def __init__(self, maxsize=4, idle_timeout=30):
+        """Keep-alive HTTP/1.1 connections, pooled per endpoint host.
+
+        Connections are handed out to one request at a time and returned to
+        the pool afterwards, so the pool can be shared between threads.
+
+        :param maxsize: max number of idle connections kept open per host.
+        Extra connections are closed once their request completes.
+            :type maxsize: int
+
+        :param idle_timeout: seconds an idle connection is kept before it is
+        evicted. Engines close idle keep-alive sockets on their own, so this
+        should stay below the server's keep-alive timeout.
+            :type idle_timeout: int | float
+        """
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+
+        self._idle = {}
+        self._lock = threading.Lock()
+
+        # Counters reported by stats()
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    def _acquire(self, key):
+        """Return an idle connection for key, or open a new one.
+
+        :param key: (scheme, host, port) tuple
+        :rtype: tuple (connection, was_reused)
+        """
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(key, [])
+
+            # Evict connections that sat idle for too long
+            fresh = [(conn, t) for conn, t in idle if now - t < self.idle_timeout]
+            for conn, t in idle:
+                if now - t >= self.idle_timeout:
+                    conn.close()
+                    self.evicted += 1
+            self._idle[key] = fresh
+
+            # Most recently used connection is the least likely to be dropped
+            if fresh:
+                conn, _ = fresh.pop()
+                self.reused += 1
+                return conn, True
+
+            self.created += 1
+
+        scheme, host, port = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, port), False
+        return httplib.HTTPConnection(host, port), False
+
+    def _release(self, key, conn):
+        """Return a connection to the pool, closing it if the pool is full."""
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.time()))
+                return
+
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        """Send a request over a pooled connection and read the whole response.
+
+        A reused connection may have been closed by the server while idle;
+        in that case the request is sent again over another connection, as
+        long as the server can't have seen it; see _is_stale. Resends share
+        timeout, so a request never takes longer than it allows.
+
+        :param method: str; "GET" or "POST"
+        :param url: str; absolute http(s) url
+        :param body: str | None
+        :param headers: dict | None
+        :param timeout: seconds connecting, or waiting on any one read, may
+        take before socket.timeout is raised. None waits indefinitely.
+        :rtype: PooledResponse
+        """
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path = '%s?%s' % (path, parts.query)
+
+        expires = time.time() + timeout if timeout is not None else None
+        while True:
+            conn, reused = self._acquire(key)
+            sending = True
+            try:
+                start = time.time()
+                if expires is not None:
+                    timeout = expires - start
+                    if timeout <= 0:
+                        raise socket.timeout('timed out')
+                conn.timeout = timeout
+                if conn.sock is None:
+                    conn.connect()
+                else:
+                    conn.sock.settimeout(timeout)
+                sent = time.time()
+                conn.request(method, path, body, headers or {})
+                sending = False
+                response = conn.getresponse()
+                first_byte = time.time()
+                data = response.read()
+                done = time.time()
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                if reused and _is_stale(e, sending):
+                    continue
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+
+            timings = {'connect': sent - start, 'ttfb': first_byte - sent, 'download': done - first_byte}
+            return PooledResponse(response.status, response.reason, response.msg, data, timings)
+
+    def stats(self):
+        """Connection counters; "reused" is the number of handshakes saved.
+
+        :rtype: dict
+        """
+        with self._lock:
+            idle = sum(len(conns) for conns in self._idle.values())
+            return {
+                'created': self.created,
+                'reused': self.reused,
+                'evicted': self.evicted,
+                'idle': idle
+            }
+
+    def close(self):
+        """Close every idle connection."""
+        with self._lock:
+            for conns in self._idle.values():
+                for conn, _ in conns:
+                    conn.close()
+            self._idle = {}
+
+
+# Pool shared by every EngineRequest that isn't given one explicitly
+default_pool = ConnectionPool()
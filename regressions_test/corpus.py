@@ -0,0 +1,233 @@
+import csv
+import json
+import os
+import time
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from Queue import Empty, Queue
+from connection_pool import ConnectionPool
+from engine_request import EngineRequest
+from registry import write_json
+
+
+# Column or key holding the utterance, in order of preference
+UTTERANCE_KEYS = ('utterance', 'entry', 'text', 'input')
+
+
+def _utterance(record):
+    for key in UTTERANCE_KEYS:
+        if record.get(key) is not None:
+            return record[key]
+    return None
+
+
+def read_utterances(path):
+    """Stream utterances from a csv or jsonl file, one line at a time.
+
+    Csv files with a header use the first of the utterance, entry, text or
+    input columns, otherwise the first column. Jsonl lines are either a
+    string or an object with one of those keys.
+
+    :param path: str; .csv, .jsonl or .json file
+    :return: generator of (line number, utterance); blank lines are skipped
+    """
+    with open(path, 'rb') as f:
+        if path.lower().endswith(('.jsonl', '.json')):
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                utterance = record if isinstance(record, basestring) else _utterance(record)
+                if utterance:
+                    yield number, utterance
+            return
+
+        rows = csv.reader(f)
+        first = next(rows, None)
+        if first is None:
+            return
+        header = [c.strip().lower() for c in first]
+        column = next((header.index(k) for k in UTTERANCE_KEYS if k in header), None)
+        if column is None:
+            column = 0
+            if first and first[0].strip():
+                yield 1, first[0].decode('utf-8')
+        for number, row in enumerate(rows, 2):
+            if len(row) > column and row[column].strip():
+                yield number, row[column].decode('utf-8')
+
+
+class _Sessions(object):
+    def __init__(self, engine, turns_per_session):
+        """Engine sessions shared by the corpus workers, each one replaced
+        after turns_per_session utterances or a failed request.
+        """
+        self.engine = engine
+        self.turns_per_session = turns_per_session
+        self._idle = Queue()
+        self._open = set()
+
+    def acquire(self):
+        """:rtype: list; [ident, turns used]"""
+        try:
+            slot = self._idle.get_nowait()
+        except Empty:
+            slot = None
+        if slot is not None and slot[1] < self.turns_per_session:
+            return slot
+        if slot is not None:
+            self.discard(slot)
+
+        session = self.engine.open_session()
+        if not session:
+            raise IOError('INIT failed: %s' % session.error)
+        self._open.add(session.ident)
+        return [session.ident, 0]
+
+    def release(self, slot):
+        slot[1] += 1
+        self._idle.put(slot)
+
+    def discard(self, slot):
+        self._open.discard(slot[0])
+        self.engine.close_session(slot[0])
+
+    def close(self):
+        self.engine.end_multiple_sessions(list(self._open), concurrency=8)
+        self._open.clear()
+
+
+def _ask(engine, sessions, number, utterance):
+    """Send one utterance.
+
+    :rtype: dict; the result line
+    """
+    result = {'line': number, 'utterance': utterance}
+    start = time.time()
+    slot = None
+    try:
+        slot = sessions.acquire()
+        start = time.time()
+        entry = utterance.encode('utf-8') if isinstance(utterance, unicode) else utterance
+        response = engine.make_request({'ident': slot[0], 'entry': entry})
+    except Exception, e:
+        if slot is not None:
+            sessions.discard(slot)
+        result.update({'latency': time.time() - start, 'error': '%s: %s' % (type(e).__name__, e)})
+        return result
+
+    sessions.release(slot)
+    result.update({
+        'latency': time.time() - start,
+        'answerID': response.get('answerID'),
+        'recognitionID': response.get('recognitionID'),
+        'userintent': response.get('userintent'),
+        'related_ids': [faq.get('AnswerId') for faq in response.get('related_list') or []],
+        'error': None
+    })
+    return result
+
+
+class Checkpoint(object):
+    def __init__(self, output):
+        """Last input line written to output, and output's size at that
+        point, kept next to the output file.
+        """
+        self.path = '%s.checkpoint' % output
+
+    def load(self):
+        """:rtype: tuple; (line, offset), (0, 0) without a checkpoint"""
+        if not os.path.exists(self.path):
+            return 0, 0
+        with open(self.path, 'r') as f:
+            data = json.loads(f.read())
+        return data['line'], data['offset']
+
+    def save(self, line, offset):
+        write_json(self.path, {'line': line, 'offset': offset})
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def run_corpus(endpoint, path, output, concurrency=8, turns_per_session=20, resume=False,
+               checkpoint_every=100, project=None, progress=None):
+    """Send every utterance in a corpus file to the engine and write one
+    json result line per utterance, in input order.
+
+    At most a few results per worker are held in memory at any time, so
+    memory use doesn't grow with the size of the corpus. A checkpoint is
+    written every checkpoint_every lines; with resume, a run starts after
+    the last checkpointed line.
+
+    :param endpoint: str; engine url
+    :param path: str; csv or jsonl corpus
+    :param output: str; jsonl results file
+    :param concurrency: number of requests in flight, and of sessions
+    :param turns_per_session: utterances sent on a session before it's replaced
+    :param resume: continue from output's checkpoint, if there is one
+    :param checkpoint_every: int
+    :param project: str; project name passed to EngineRequest
+    :param progress: callable given the counts dict after each checkpoint
+    :return: counts of utterances sent, errors and answered, and the line resumed after
+        :rtype: dict
+    """
+    engine = EngineRequest(endpoint, project=project, pool=ConnectionPool(maxsize=concurrency), lazy=True)
+    sessions = _Sessions(engine, turns_per_session)
+    checkpoint = Checkpoint(output)
+
+    done, offset = checkpoint.load() if resume else (0, 0)
+    out = open(output, 'r+b' if resume and os.path.exists(output) else 'wb')
+    out.seek(offset)
+    out.truncate()
+
+    counts = {'sent': 0, 'errors': 0, 'answered': 0, 'resumed_after': done, 'started': time.time()}
+    workers = ThreadPool(concurrency)
+    pending = deque()
+    last = done
+
+    def write(result):
+        out.write(json.dumps(result, sort_keys=True) + '\n')
+        counts['sent'] += 1
+        if result['error']:
+            counts['errors'] += 1
+        elif result.get('answerID') not in (None, '', '0'):
+            counts['answered'] += 1
+        if counts['sent'] % checkpoint_every == 0:
+            out.flush()
+            checkpoint.save(result['line'], out.tell())
+            if progress:
+                progress(counts)
+        return result['line']
+
+    try:
+        try:
+            for number, utterance in read_utterances(path):
+                if number <= done:
+                    continue
+                pending.append(workers.apply_async(_ask, (engine, sessions, number, utterance)))
+                # Keep a bounded window of requests in flight; results are
+                # written in input order as the oldest one completes
+                if len(pending) >= concurrency * 4:
+                    last = write(pending.popleft().get())
+            while pending:
+                last = write(pending.popleft().get())
+        except KeyboardInterrupt:
+            # An interrupt inside apply_async can leave a job in the pool's
+            # cache that is never queued, and join() would wait for it forever
+            workers.terminate()
+            raise
+        workers.close()
+        workers.join()
+    finally:
+        out.flush()
+        checkpoint.save(last, out.tell())
+        out.close()
+        sessions.close()
+        engine.pool.close()
+
+    checkpoint.remove()
+    counts['duration'] = time.time() - counts.pop('started')
+    return counts
@@ -1,10 +1,202 @@
+import atexit
+import copy
+import httplib
+import socket
+import threading
+import time
 import urllib
 import urllib2
-import xml.etree.ElementTree as ET
+import urlparse
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+from connection_pool import default_pool
+from parsers import get_parser
+from resilience import RetryPolicy, breaker_for, is_engine_failure
+from response import EngineResponse
+
+
+# Redirects urllib2 follows; the redirected request is sent as a GET.
+REDIRECT_CODES = (301, 302, 303, 307)
+
+# Seconds connecting to the engine, or waiting on a read, may take
+DEFAULT_TIMEOUT = 30
+
+# Transaction types reported in Timing records
+INIT = 'init'
+ENTRY = 'entry'
+FAQ = 'faq'
+CLOSE = 'close'
+
+# Callables given a Timing for every request an EngineRequest makes.
+# Timings are only measured while at least one hook is registered.
+timing_hooks = []
+
+
+class Timing(namedtuple('Timing', 'transaction endpoint entry connect ttfb download parse total '
+                                  'bytes_sent bytes_received error')):
+    """Where the time of one engine request went.
+
+    Times are in seconds: connect, ttfb (time to first byte) and download
+    are summed over redirects, parse is spent turning the response into a
+    dict, total is the whole call. error is the exception message if the
+    request failed.
+    """
+    __slots__ = ()
+
+
+def transaction_type(params):
+    """INIT, ENTRY, FAQ or CLOSE, for the params of a request.
+
+    :param params: dict | None
+    :rtype: str
+    """
+    if not params or not params.get('ident'):
+        return INIT
+    if params.get('sessionclosed'):
+        return CLOSE
+    if params.get('faq'):
+        return FAQ
+    return ENTRY
+
+
+class SessionResult(namedtuple('SessionResult', 'ident latency success error response')):
+    """Outcome of opening or closing one engine session.
+
+    latency is in seconds; error is the exception message, if any;
+    response is the parsed INIT response for opened sessions.
+    A SessionResult is truthy when the call succeeded.
+    """
+    __slots__ = ()
+
+    def __nonzero__(self):
+        return self.success
+
+
+class SessionResults(list):
+    """List of SessionResult with summary helpers.
+
+    Like any list it is true when it isn't empty, even if every call
+    failed; use all() for a success flag.
+    """
+
+    def all(self):
+        """True if every session call succeeded."""
+        return all(self)
+
+    @property
+    def idents(self):
+        """Session ids of the successful calls."""
+        return [r.ident for r in self if r.success]
+
+    @property
+    def failures(self):
+        return [r for r in self if not r.success]
+
+
+def run_concurrently(func, items, concurrency=1):
+    """Call func on each item using at most concurrency worker threads.
+    Results are returned in the same order as items.
+
+    :param func: callable taking one item
+    :param items: list
+    :param concurrency: int; 1 runs the calls sequentially
+    :rtype: list
+    """
+    items = list(items)
+    workers = min(concurrency, len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class SessionTracker(object):
+    def __init__(self):
+        """Engine sessions opened through EngineRequest objects and not closed yet.
+
+        Sessions still open when the process exits, or when a pytest run
+        ends, are closed together by close_all, so failed or interrupted
+        runs don't leave live sessions on the engine.
+        """
+        self.opened = 0
+        self.closed = 0
+        self.failed = 0
+
+        # ident: EngineRequest that opened the session
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def add(self, engine, ident):
+        with self._lock:
+            # Replayed cassettes hand out the same idents again
+            if ident not in self._open:
+                self.opened += 1
+            self._open[ident] = engine
+
+    def discard(self, ident):
+        with self._lock:
+            if self._open.pop(ident, None) is not None:
+                self.closed += 1
+
+    def close_all(self, concurrency=16):
+        """End every tracked session, concurrently. Sessions that can't be
+        closed are counted as failed and no longer tracked.
+
+        :param concurrency: max number of requests in flight at once
+        :rtype: SessionResults
+        """
+        with self._lock:
+            sessions = self._open.items()
+        if not sessions:
+            return SessionResults()
+
+        results = SessionResults(run_concurrently(lambda s: _closer(s[1]).close_session(s[0]),
+                                                  sessions, concurrency))
+        with self._lock:
+            for ident, _ in sessions:
+                if self._open.pop(ident, None) is not None:
+                    self.failed += 1
+        return results
+
+    def stats(self):
+        """Session counters; "open" is the number not closed yet.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'opened': self.opened,
+                'closed': self.closed,
+                'failed': self.failed,
+                'open': len(self._open)
+            }
+
+
+def _closer(engine):
+    """EngineRequest to close engine's sessions with. The run's deadline
+    doesn't apply; a leaked session costs the engine more than the wait."""
+    if engine.deadline is None:
+        return engine
+    closer = copy.copy(engine)
+    closer.deadline = None
+    return closer
+
+
+# Tracks the sessions of every EngineRequest not given a tracker of its own
+default_tracker = SessionTracker()
+atexit.register(default_tracker.close_all)
 
 
 class EngineRequest(object):
-    def __init__(self, endpoint, project=None):
+    def __init__(self, endpoint, project=None, pool=None, parser=None, lazy=False, cache=None,
+                 version_number=None, timeout=DEFAULT_TIMEOUT, retry=None, deadline=None, breaker=None,
+                 tracker=None):
         """Set up the engine endpoints, as well as the project name.
 
         :param endpoint: http url endpoint where requests will be made
@@ -16,9 +208,160 @@ class EngineRequest(object):
         made, based on the project name provided.
         --Current list of expected project names: [TWC]
             :type project: str
+
+        :param pool: keep-alive connection pool requests are sent through.
+        Defaults to the pool shared by all EngineRequest objects.
+            :type pool: ConnectionPool
+
+        :param parser: response parser backend, by name or instance.
+        Defaults to the fastest backend available; see parsers.PARSERS.
+            :type parser: str
+
+        :param lazy: If True, responses are returned as read only
+        EngineResponse objects that only parse the fields that are read,
+        instead of dicts. Responses under response.EAGER_SIZE (4 KB) are
+        parsed whole, as that is cheaper.
+            :type lazy: bool
+
+        :param cache: response cache used by make_request(cache=True).
+        Without one, requests are never cached.
+            :type cache: ResponseCache
+
+        :param version_number: kb version number cached responses are kept
+        under, so a new kb version never sees answers of the old one.
+            :type version_number: str
+
+        :param timeout: seconds a connect or read may take before the
+        request fails. None waits indefinitely.
+            :type timeout: int | float
+
+        :param retry: how idempotent requests (INIT and session close) are
+        retried after a connection error, timeout or 5xx response.
+        Defaults to RetryPolicy().
+            :type retry: RetryPolicy
+
+        :param deadline: budget shared by the whole run; request timeouts
+        are cut down to the time left, and requests fail with
+        DeadlineExceeded once it has passed.
+            :type deadline: Deadline
+
+        :param breaker: Defaults to the circuit breaker shared by every
+        EngineRequest for this endpoint.
+            :type breaker: CircuitBreaker
+
+        :param tracker: keeps every session opened until it is closed.
+        Defaults to the tracker shared by all EngineRequest objects, whose
+        sessions are closed when the process exits.
+            :type tracker: SessionTracker
         """
         self.endpoint = endpoint
         self.project = project
+        self.pool = pool if pool is not None else default_pool
+        self.parser = get_parser(parser)
+        self.lazy = lazy
+        self.cache = cache
+        self.version_number = version_number
+        self.timeout = timeout
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.deadline = deadline
+        self.breaker = breaker if breaker is not None else breaker_for(endpoint)
+        self.tracker = tracker if tracker is not None else default_tracker
+
+    def _send(self, params=None, timing=None, idempotent=False):
+        """Send params to the endpoint over a pooled connection.
+        A GET is made when params is None, otherwise params are
+        form encoded and POSTed; same as urllib2.urlopen.
+
+        :param params: dict | None
+
+        :param timing: if given, connect, ttfb, download and byte counts
+        are added to it.
+            :type timing: dict
+
+        :param idempotent: retry the request on engine failures, following
+        the retry policy.
+            :type idempotent: bool
+
+        :rtype: str
+        """
+        attempt = 0
+        while True:
+            timeout = self.deadline.timeout(self.timeout) if self.deadline else self.timeout
+            self.breaker.before()
+            try:
+                response = self._send_once(params, timing, timeout)
+            except urllib2.URLError, e:
+                if not is_engine_failure(e):
+                    self.breaker.success()
+                    raise
+                self.breaker.failure()
+                if not idempotent or attempt >= self.retry.retries:
+                    raise
+                delay = self.retry.delay(attempt)
+                if self.deadline and self.deadline.remaining() <= delay:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            except Exception:
+                # Not an answer from the engine either way; don't hold a
+                # half-open breaker's trial
+                self.breaker.success()
+                raise
+
+            self.breaker.success()
+            return response
+
+    def _send_once(self, params, timing, timeout):
+        url = self.endpoint
+        if params is None:
+            method, body, headers = 'GET', None, {}
+        else:
+            method, body = 'POST', urllib.urlencode(params)
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+        # Follow redirects the way urllib2 does
+        for _ in range(10):
+            try:
+                response = self.pool.request(method, url, body, headers, timeout)
+            except (httplib.HTTPException, socket.error), e:
+                raise urllib2.URLError(e)
+            if timing is not None:
+                for key, value in (response.timings or {}).items():
+                    timing[key] = timing.get(key, 0) + value
+                timing['bytes_sent'] = timing.get('bytes_sent', 0) + len(body or '')
+                timing['bytes_received'] = timing.get('bytes_received', 0) + len(response.body)
+            if response.status not in REDIRECT_CODES:
+                break
+            if response.status == 307 and method != 'GET':
+                break
+            location = response.headers.get('location')
+            if not location:
+                break
+            url = urlparse.urljoin(url, location)
+            method, body, headers = 'GET', None, {}
+
+        if response.status >= 400:
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.headers, StringIO(response.body))
+
+        return response.body
+
+    def _record_timing(self, params, timing, start, error=None):
+        """Pass a Timing for a finished request to every timing hook."""
+        record = Timing(transaction=transaction_type(params),
+                        endpoint=self.endpoint,
+                        entry=(params or {}).get('entry'),
+                        connect=timing.get('connect', 0),
+                        ttfb=timing.get('ttfb', 0),
+                        download=timing.get('download', 0),
+                        parse=timing.get('parse', 0),
+                        total=time.time() - start,
+                        bytes_sent=timing.get('bytes_sent', 0),
+                        bytes_received=timing.get('bytes_received', 0),
+                        error=str(error) if error is not None else None)
+        for hook in timing_hooks:
+            hook(record)
 
     def _parse_project_params(self, response_tree, data):
         """Parse any project specific params and add to the
@@ -41,7 +384,7 @@ class EngineRequest(object):
                 data['ilar_response'] = response_tree.find(
                     'ilarresponse').text.encode('ascii', 'ignore')
 
-    def make_request(self, params=None, ignore_response=False, raw_response=False):
+    def make_request(self, params=None, ignore_response=False, raw_response=False, cache=False):
         """Make a request to the specified endpoint. If url params are given,
         pass them into the request.
 
@@ -53,7 +396,15 @@ class EngineRequest(object):
 
         :param raw_response: If this flag is True an xml string is returned instead of dict
 
-        :rtype: dict | string | None
+        :param cache: If True and the EngineRequest has a cache, the response
+        is served from the cache when possible and cached otherwise. Only
+        use for requests whose answer can't change within a kb version,
+        such as faq lookups. Answers that depend on what the engine serves
+        right now, like the versionnumber probe, must never be cached: one
+        seen mid publish would be served for the whole cache ttl.
+            :type cache: bool
+
+        :rtype: dict | EngineResponse | string | None
         """
         # If we're pinging the TWC engine ensure that integration is disabled,
         # and default channel and BA is provided.
@@ -63,17 +414,48 @@ class EngineRequest(object):
             else:
                 params = {'disable_integration': 'true'}
 
-        # Make the request to the endpoint
-        if params is None:
-            response = urllib2.urlopen(self.endpoint)
-        else:
-            response = urllib2.urlopen(self.endpoint, urllib.urlencode(params))
-
+        cache = cache and self.cache is not None
+        if cache:
+            response = self.cache.get(self.endpoint, params, self.version_number)
+            if response is not None:
+                return self._read_response(response, ignore_response, raw_response)
+
+        timing = {} if timing_hooks else None
+        start = time.time()
+        try:
+            # Make the request to the endpoint; a new session can safely be retried
+            response = self._send(params, timing, idempotent=transaction_type(params) == INIT)
+            if cache:
+                self.cache.put(self.endpoint, params, self.version_number, response)
+
+            parse_start = time.time()
+            result = self._read_response(response, ignore_response, raw_response)
+        except Exception, e:
+            if timing is not None:
+                self._record_timing(params, timing, start, e)
+            raise
+
+        if timing is not None:
+            timing['parse'] = time.time() - parse_start
+            self._record_timing(params, timing, start)
+        if transaction_type(params) == INIT:
+            self._track(response, result)
+        return result
+
+    def _track(self, response, result):
+        """Track the session an INIT response opened."""
+        if not hasattr(result, 'get'):
+            # Raw or ignored response; only read the ident
+            result = self.parse_response(response, lazy=True)
+        ident = result.get('ident')
+        if ident:
+            self.tracker.add(self, ident)
+
+    def _read_response(self, response, ignore_response=False, raw_response=False):
         if raw_response:
-            r = ET.fromstring(response.read())
-            return r.iter()
+            return self.parser.iter_elements(response)
         elif not ignore_response:
-            return self.parse_response(response.read())
+            return self.parse_response(response)
         else:
             return None
 
@@ -90,112 +472,105 @@ class EngineRequest(object):
             'ident': session_id,
             'sessionclosed': 1  # Requests a session to be closed
         }
-        response = urllib2.urlopen(
-            self.endpoint, urllib.urlencode(params)).read()
+        timing = {} if timing_hooks else None
+        start = time.time()
+        try:
+            response = self._send(params, timing, idempotent=True)
+        except Exception, e:
+            if timing is not None:
+                self._record_timing(params, timing, start, e)
+            raise
+
+        # The engine answered; a non blank answer won't change on a retry
+        self.tracker.discard(session_id)
+        if timing is not None:
+            self._record_timing(params, timing, start)
 
         return response == ''
 
-    def end_multiple_sessions(self, session_ids):
+    def open_session(self):
+        """Make an INIT request and time it. Errors are captured in the
+        result rather than raised.
+
+        :rtype: SessionResult
+        """
+        start = time.time()
+        try:
+            response = self.make_request()
+        except Exception, e:
+            return SessionResult(None, time.time() - start, False, str(e), None)
+
+        ident = response.get('ident')
+        error = None if ident else 'No ident in INIT response'
+        return SessionResult(ident, time.time() - start, bool(ident), error, response)
+
+    def close_session(self, session_id):
+        """Make an "end session" request and time it. Errors are captured
+        in the result rather than raised.
+
+        :param session_id: str
+        :rtype: SessionResult
+        """
+        start = time.time()
+        try:
+            closed = self.end_session(session_id)
+        except Exception, e:
+            return SessionResult(session_id, time.time() - start, False, str(e), None)
+
+        error = None if closed else 'Engine returned a non blank response'
+        return SessionResult(session_id, time.time() - start, closed, error, None)
+
+    def end_multiple_sessions(self, session_ids, concurrency=1):
         """Make multiple "end session" requests to the endpoint.
 
-        Return True/False depending on the engine responses.
-        The responses should be blank if the session
-        was properly closed.
+        A session was properly closed if the engine response was blank.
+        This used to return a bool; use .all() on the returned list for
+        that success flag, as the list itself is true whenever it isn't
+        empty.
 
         :param session_ids: list of session IDs to close
             :type session_ids: list
 
-        :return: a success flag based on all sessionIDs being closed
-            :type: bool
-        """
-        # Maintain a list of return bools to determine if all session closes
-        # were a success.
-        sessions_were_closed = []
-
-        for session_id in session_ids:
-            was_closed = self.end_session(session_id=session_id)
-            sessions_were_closed.append(was_closed)
+        :param concurrency: max number of requests in flight at once
+            :type concurrency: int
 
-        return all(sessions_were_closed)
+        :return: a result per session id, in the order given
+            :rtype: SessionResults
+        """
+        return SessionResults(run_concurrently(self.close_session, session_ids, concurrency))
 
-    def open_new_sessions(self, number_of_sessions=1):
+    def open_new_sessions(self, number_of_sessions=1, concurrency=1):
         """Make requests to the endpoint to open x number of sessions.
 
         :param number_of_sessions: optional param to dictate how many
             sessions should be created
 
-        :return: list of session_ids that were spawned
-            :rtype: list
-        """
-        session_ids = []
-
-        for x in range(0, number_of_sessions):
-            init_request = self.make_request()
-            session_ids.append(init_request['ident'])
-            print 'Acquired SessionID #%s: %s' % (
-                x, init_request['ident']
-            )
+        :param concurrency: max number of requests in flight at once
+            :type concurrency: int
 
-        return session_ids
+        :return: a result per INIT request, failed ones included; .idents
+        lists the session_ids that were spawned, which used to be returned
+        directly
+            :rtype: SessionResults
+        """
+        return SessionResults(run_concurrently(lambda _: self.open_session(),
+                                               range(number_of_sessions), concurrency))
 
-    def parse_response(self, response):
+    def parse_response(self, response, lazy=None):
         """Parse the engine response into a dict.
         Don't cast ID values to int() here, as a None may be
         returned if no value is populated in the engine response.
 
         :param response: str
-        :rtype: dict
-        """
-        elm_tree = ET.fromstring(response)
-        data = {}
-        for child in elm_tree:
-
-            temp_list = []
-            # related faqs
-            if child.tag == 'faqitems':
-                # if there are any related faqs present store each faq as an object in temp list this store list in return value.
-                related_list = child.find('suggestedfaqlist').find('semanticfaqs')
-                if len(related_list):
-                    for faq in related_list:
-                        temp_dict = {}
-                        for el in faq:
-                            temp_dict[el.tag] = el.text
-                        temp_list.append(temp_dict)
-                        # temp_list.append({
-                        #     'answer_id': faq.find('AnswerId'),
-                        #     'recognition_id': faq.find('RecognitionId'),
-                        #     'question_text': faq.find('QuestionText')
-                        # })
-                    data['related_list'] = temp_list
-
-                else:
-                    data['related_list'] = None
-
-            elif child.tag.lower() == 'connectors':
-                if len(child):
-                    for connector in child:
-                        temp_dict = {}
-                        for el in connector:
-                            temp_dict[el.tag] = el.text
-                        temp_list.append(temp_dict)
-                    data['connectors'] = temp_list
-
-                else:
-                    data['connectors'] = None
-
-            elif child.tag.lower() == 'disambiguationoptions':
-                if len(child):
-                    for option in child:
-                        temp_dict = {}
-                        for el in option:
-                            temp_dict[el.tag] = el.text
-                        temp_list.append(temp_dict)
-                    data['disambiguationoptions'] = temp_list
-
-                else:
-                    data['disambiguationoptions'] = None
 
-            else:
-                data[child.tag] = child.text
+        :param lazy: return an EngineResponse instead of a dict.
+        Defaults to the lazy flag the EngineRequest was created with.
+            :type lazy: bool
 
-        return data
+        :rtype: dict | EngineResponse
+        """
+        if lazy is None:
+            lazy = self.lazy
+        if lazy:
+            return EngineResponse(response)
+        return self.parser.parse(response)
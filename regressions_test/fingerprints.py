@@ -0,0 +1,194 @@
+import hashlib
+import inspect
+import json
+import os
+import pytest
+from registry import default_registry, file_lock, write_json
+
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+FINGERPRINT_DIRECTORY = os.path.join(DIRECTORY, 'fingerprints')
+
+# Config keys read by fixtures that take project_config. Fixtures that take
+# project_config but aren't listed here are assumed to read all of it.
+CONFIG_KEYS = {
+    'endpoint': [],  # the endpoint url is part of every fingerprint
+    'shared_session': [],
+    'cassette': ['name'],
+    'engine': ['version_number'],
+    'version_number': ['version_number'],
+    'live_chat_values': ['live_chat_values'],
+    'active_close_values': ['active_close_values'],
+    'semantic_input': ['semantic_input'],
+    'custom_back_text_values': ['custom_back_text_values'],
+    'blank_connector_values': ['blank_connector_values'],
+    'dtree_input': ['dtree_input'],
+    'related_results_prompt': ['related_results_prompt'],
+    'multipart_answer': ['multipart_answer_values'],
+    # scenario tests are fingerprinted on their own scenario only
+    'scenario_results': [],
+    # fixed key lists
+    'response_keys': [],
+    'init_none_keys': [],
+    'init_value_keys': [],
+}
+
+ALL_KEYS = '*'
+
+
+def path_for(project, environment):
+    """Fingerprint file for a project's environment.
+
+    :rtype: str
+    """
+    name = '%s_%s.json' % (project.lower().replace(' ', '_'), environment)
+    return os.path.join(FINGERPRINT_DIRECTORY, name)
+
+
+def config_keys(item):
+    """Config keys the fixtures of a test read, or ALL_KEYS.
+
+    :param item: pytest test item
+    :rtype: list | str
+    """
+    info = item._fixtureinfo
+    if 'project_config' in info.argnames:
+        return ALL_KEYS
+
+    keys = set()
+    for name in item.fixturenames:
+        definitions = info.name2fixturedefs.get(name)
+        if not definitions or 'project_config' not in definitions[-1].argnames:
+            continue
+        if name not in CONFIG_KEYS:
+            return ALL_KEYS
+        keys.update(CONFIG_KEYS[name])
+    return sorted(keys)
+
+
+def fingerprint(item, config, endpoint):
+    """Hash of everything a test's result depends on: the config keys its
+    fixtures read, the endpoint, the kb version number and the test's source.
+
+    :param item: pytest test item
+    :param config: dict; project config
+    :param endpoint: str; endpoint url
+    :rtype: str
+    """
+    keys = config_keys(item)
+    values = config if keys == ALL_KEYS else dict((k, config.get(k)) for k in keys)
+
+    params = getattr(getattr(item, 'callspec', None), 'params', {})
+    if params.get('scenario') is not None:
+        values = dict(values, scenario=[s for s in config.get('scenarios', [])
+                                        if s.get('name') == params['scenario']])
+
+    try:
+        source = inspect.getsource(item.function)
+    except (IOError, TypeError):
+        source = item.nodeid
+
+    data = json.dumps({'config': values,
+                       'endpoint': endpoint,
+                       'version_number': config.get('version_number'),
+                       'source': source}, sort_keys=True)
+    return hashlib.sha1(data).hexdigest()
+
+
+class ChangedOnly(object):
+    """pytest plugin recording a fingerprint and outcome per test, in a
+    file per target.
+
+    With changed_only, tests whose fingerprint matches the one recorded
+    the last time they passed (or were skipped) are deselected.
+    """
+
+    def __init__(self, targets, changed_only=False, registry=default_registry):
+        """
+        :param targets: list of Target the run's tests are parametrized over
+        :param changed_only: bool
+        :param registry: ProjectRegistry configs are read from
+        """
+        self.targets = targets
+        self.changed_only = changed_only
+        self.registry = registry
+
+        self.current = {}
+        self.target_of = {}
+        self.outcomes = {}
+        self.deselected = []
+
+    @staticmethod
+    def _load(target):
+        path = path_for(target.project, target.environment)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r') as f:
+                return json.loads(f.read())
+        except ValueError:
+            return {}
+
+    # Wraps every other plugin, so fingerprints are taken of the whole
+    # collection, before shards deselect the tests of other shards, and
+    # unchanged tests are only deselected from what the shard kept
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_collection_modifyitems(self, session, config, items):
+        configs = {}
+        for item in items:
+            target = getattr(getattr(item, 'callspec', None), 'params', {}).get('target')
+            if target is None:
+                continue
+            if target not in configs:
+                project_config = self.registry.load(target.project)
+                configs[target] = project_config, project_config.get('endpoints', {}).get(target.environment)
+            self.current[item.nodeid] = fingerprint(item, *configs[target])
+            self.target_of[item.nodeid] = target
+
+        yield
+        if not self.changed_only:
+            return
+
+        # Node ids include the target, so one dict holds every target's tests
+        recorded = {}
+        for target in configs:
+            recorded.update(self._load(target))
+
+        selected = []
+        for item in items:
+            previous = recorded.get(item.nodeid, {})
+            if item.nodeid in self.current and previous.get('fingerprint') == self.current[item.nodeid] and \
+                    previous.get('outcome') in ('passed', 'skipped'):
+                self.deselected.append(item)
+            else:
+                selected.append(item)
+
+        if self.deselected:
+            config.hook.pytest_deselected(items=self.deselected)
+            items[:] = selected
+
+    def pytest_runtest_logreport(self, report):
+        if report.failed:
+            self.outcomes[report.nodeid] = 'failed'
+        elif report.skipped:
+            self.outcomes.setdefault(report.nodeid, 'skipped')
+        elif report.when == 'call':
+            self.outcomes.setdefault(report.nodeid, 'passed')
+
+    def pytest_sessionfinish(self, session, exitstatus):
+        for target in set(self.target_of[n] for n in self.outcomes if n in self.target_of):
+            path = path_for(target.project, target.environment)
+            # Shards of a run may update the same file at the same time
+            with file_lock(path):
+                recorded = self._load(target)
+                for nodeid, outcome in self.outcomes.items():
+                    if self.target_of.get(nodeid) == target:
+                        recorded[nodeid] = {'fingerprint': self.current[nodeid], 'outcome': outcome}
+                # Forget tests that no longer exist; every collected test
+                # counts, whichever shard runs it
+                recorded = dict((k, v) for k, v in recorded.items() if self.target_of.get(k) == target)
+                write_json(path, recorded)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.changed_only:
+            terminalreporter.write_line('--changed-only: %d unchanged tests not rerun' % len(self.deselected))
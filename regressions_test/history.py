@@ -0,0 +1,327 @@
+import os
+import sqlite3
+import threading
+import time
+from results import ResultCollector
+from stats import format_ms, percentile, table_lines
+from targets import target_of
+
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+HISTORY_FILE = os.path.join(DIRECTORY, '.history.sqlite')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    project TEXT NOT NULL,
+    environment TEXT NOT NULL,
+    version_number TEXT,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    passed INTEGER NOT NULL,
+    failed INTEGER NOT NULL,
+    error INTEGER NOT NULL,
+    skipped INTEGER NOT NULL,
+    shard TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_target ON runs (project, environment, started);
+CREATE TABLE IF NOT EXISTS tests (
+    run_id INTEGER NOT NULL,
+    test TEXT NOT NULL,
+    outcome TEXT,
+    duration REAL NOT NULL,
+    requests INTEGER NOT NULL,
+    engine REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tests_run ON tests (run_id, test);
+CREATE TABLE IF NOT EXISTS transactions (
+    run_id INTEGER NOT NULL,
+    test TEXT,
+    type TEXT NOT NULL,
+    total REAL NOT NULL,
+    ttfb REAL NOT NULL,
+    error INTEGER NOT NULL,
+    entry TEXT
+);
+CREATE INDEX IF NOT EXISTS transactions_run ON transactions (run_id, type);
+"""
+
+
+def test_name(nodeid, target):
+    """Name of a test shared by every target and run, e.g.
+    main_tests.py::test_semantic, or main_tests.py::test_scenario[billing]
+    for the billing scenario.
+
+    :param nodeid: str; pytest node id
+    :param target: Target the node id belongs to
+    :rtype: str
+    """
+    path, sep, name = nodeid.rpartition('.py::')
+    name = '%s.py::%s' % (os.path.basename(path), name) if sep else nodeid
+    if name.endswith('[%s]' % target.id):
+        return name[:-len(target.id) - 2]
+    return name.replace('[%s-' % target.id, '[', 1)
+
+
+class HistoryStore(object):
+    def __init__(self, path=HISTORY_FILE):
+        """Test runs kept in a local sqlite database.
+
+        Each run of a target stores its outcome counts, every test's outcome,
+        duration and engine time, and every engine transaction's latency.
+        Queries only read the rows of the runs asked for, through the run
+        indexes, so they stay fast however many runs are stored.
+
+        :param path: str; sqlite database file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        # Databases created before inputs were stored
+        columns = [row[1] for row in self._db.execute('PRAGMA table_info(transactions)')]
+        if 'entry' not in columns:
+            self._db.execute('ALTER TABLE transactions ADD COLUMN entry TEXT')
+
+    def record(self, project, environment, version_number, started, duration, counts, tests, transactions,
+               shard=None):
+        """Store one run of a target.
+
+        :param counts: dict of outcome: number of tests
+        :param tests: list of (test, outcome, duration, requests, engine seconds)
+        :param transactions: list of (test, transaction type, total seconds, ttfb seconds, error, input)
+        :param shard: str; "K/N" for a shard of a run
+        :return: id of the run
+            :rtype: int
+        """
+        with self._lock:
+            with self._db:
+                run_id = self._db.execute(
+                    'INSERT INTO runs (project, environment, version_number, started, duration, '
+                    'passed, failed, error, skipped, shard) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (project, environment, version_number, started, duration, counts.get('passed', 0),
+                     counts.get('failed', 0), counts.get('error', 0), counts.get('skipped', 0), shard)).lastrowid
+                self._db.executemany('INSERT INTO tests VALUES (?, ?, ?, ?, ?, ?)',
+                                     [(run_id,) + tuple(t) for t in tests])
+                self._db.executemany('INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                     [(run_id, test, kind, total, ttfb, int(bool(error)), entry or None)
+                                      for test, kind, total, ttfb, error, entry in transactions])
+        return run_id
+
+    def runs(self, project, environment=None, limit=30, version_number=None):
+        """The latest runs of a project, newest first.
+
+        :param version_number: only runs against this kb version
+        :rtype: list of dict
+        """
+        query = 'SELECT * FROM runs WHERE project = ?'
+        args = [project]
+        if environment:
+            query += ' AND environment = ?'
+            args.append(environment)
+        if version_number is not None:
+            query += ' AND version_number = ?'
+            args.append(str(version_number))
+        query += ' ORDER BY started DESC LIMIT ?'
+        args.append(limit)
+
+        with self._lock:
+            cursor = self._db.execute(query, args)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def previous_version(self, project, environment, version_number):
+        """The kb version of the latest run of a target against any other
+        kb version than version_number, or None.
+
+        :rtype: str | None
+        """
+        with self._lock:
+            row = self._db.execute('SELECT version_number FROM runs WHERE project = ? AND environment = ? '
+                                   'AND version_number != ? ORDER BY started DESC LIMIT 1',
+                                   (project, environment, str(version_number))).fetchone()
+        return row[0] if row else None
+
+    def _select(self, query, run_ids, *args):
+        marks = ', '.join('?' * len(run_ids))
+        with self._lock:
+            return self._db.execute(query % marks, list(run_ids) + list(args)).fetchall()
+
+    def test_trends(self, run_ids):
+        """Outcomes and durations of every test over the given runs.
+
+        :param run_ids: list of run ids
+        :return: test: {"outcomes": list, "durations": list, "engine": list}, runs oldest first
+            :rtype: dict
+        """
+        if not run_ids:
+            return {}
+        rows = self._select('SELECT test, outcome, duration, engine FROM tests WHERE run_id IN (%s) '
+                            'ORDER BY run_id', run_ids)
+        trends = {}
+        for test, outcome, duration, engine in rows:
+            trend = trends.setdefault(test, {'outcomes': [], 'durations': [], 'engine': []})
+            trend['outcomes'].append(outcome)
+            trend['durations'].append(duration)
+            trend['engine'].append(engine)
+        return trends
+
+    def test_runs(self, run_ids, test):
+        """One test's result in each of the given runs.
+
+        :return: list of (run id, outcome, duration, requests, engine seconds)
+        """
+        if not run_ids:
+            return []
+        return self._select('SELECT run_id, outcome, duration, requests, engine FROM tests '
+                            'WHERE run_id IN (%s) AND test = ? ORDER BY run_id', run_ids, test)
+
+    def transaction_latencies(self, run_ids, test=None):
+        """Latency of every engine transaction in the given runs, by type.
+
+        :param test: only the transactions of this test
+        :return: transaction type: list of total seconds
+            :rtype: dict
+        """
+        if not run_ids:
+            return {}
+        query = 'SELECT type, total FROM transactions WHERE run_id IN (%s)'
+        args = []
+        if test:
+            query += ' AND test = ?'
+            args.append(test)
+        latencies = {}
+        for kind, total in self._select(query, run_ids, *args):
+            latencies.setdefault(kind, []).append(total)
+        return latencies
+
+    def transactions(self, run_ids):
+        """Every engine transaction of the given runs that didn't fail.
+
+        :return: list of {"test", "transaction", "total", "entry"} dicts
+        """
+        if not run_ids:
+            return []
+        rows = self._select('SELECT test, type, total, entry FROM transactions WHERE run_id IN (%s) '
+                            'AND error = 0', run_ids)
+        return [{'test': test, 'transaction': kind, 'total': total, 'entry': entry}
+                for test, kind, total, entry in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class HistoryRecorder(ResultCollector):
+    """pytest plugin storing each target's run in a HistoryStore.
+
+    Engine transactions are taken from the run's TimingCollector.
+    """
+
+    def __init__(self, targets, timings, registry, path=HISTORY_FILE, shard=None):
+        """
+        :param targets: list of Target the run's tests are parametrized over
+        :param timings: TimingCollector of the run
+        :param registry: ProjectRegistry the kb version numbers are read from
+        :param path: str; sqlite database file
+        :param shard: str; "K/N" for a shard of a run
+        """
+        super(HistoryRecorder, self).__init__(targets)
+        self.timings = timings
+        self.registry = registry
+        self.path = path
+        self.shard = shard
+
+    def pytest_sessionfinish(self, session, exitstatus):
+        super(HistoryRecorder, self).pytest_sessionfinish(session, exitstatus)
+
+        runs = {}
+        for nodeid, test in self.tests.items():
+            target = target_of(nodeid, self.targets)
+            if target is not None and test['outcome'] is not None:
+                runs.setdefault(target, {})[nodeid] = test
+        if not runs:
+            return
+
+        engine = {}
+        for nodeid, timing in self.timings.records:
+            engine.setdefault(nodeid, []).append(timing)
+
+        store = HistoryStore(self.path)
+        try:
+            for target, tests in runs.items():
+                counts = {}
+                rows = []
+                transactions = []
+                for nodeid, test in tests.items():
+                    name = test_name(nodeid, target)
+                    timings = engine.get(nodeid, [])
+                    counts[test['outcome']] = counts.get(test['outcome'], 0) + 1
+                    rows.append((name, test['outcome'], test['duration'], len(timings),
+                                 sum(t.connect + t.ttfb + t.download for t in timings)))
+                    transactions.extend((name, t.transaction, t.total, t.ttfb, t.error, t.entry) for t in timings)
+
+                version_number = self.registry.load(target.project).get('version_number')
+                store.record(target.project, target.environment, version_number, self.started,
+                             self.summary(target)['duration'], counts, rows, transactions, self.shard)
+        finally:
+            store.close()
+
+
+def format_runs(runs):
+    """Format HistoryStore.runs() as a plain text table.
+
+    :rtype: str
+    """
+    header = ['STARTED', 'ENVIRONMENT', 'KB VERSION', 'PASSED', 'FAILED', 'ERROR', 'SKIPPED', 'TIME', 'SHARD']
+    lines = [header]
+    for run in runs:
+        lines.append([time.strftime('%Y-%m-%d %H:%M', time.localtime(run['started'])), run['environment'],
+                      str(run['version_number']), str(run['passed']), str(run['failed']), str(run['error']),
+                      str(run['skipped']), '%.1fs' % run['duration'], run['shard'] or '-'])
+    return '\n'.join(table_lines(lines))
+
+
+def format_trends(trends):
+    """Format HistoryStore.test_trends() as a plain text table.
+
+    :rtype: str
+    """
+    header = ['TEST', 'RUNS', 'PASS %', 'P50 MS', 'P95 MS', 'ENGINE P95 MS', 'LAST']
+    lines = [header]
+    for test, trend in sorted(trends.items()):
+        outcomes = trend['outcomes']
+        ran = [o for o in outcomes if o != 'skipped']
+        lines.append([test, str(len(outcomes)),
+                      '%.0f' % (100.0 * ran.count('passed') / len(ran)) if ran else '-',
+                      format_ms(percentile(trend['durations'], 50)), format_ms(percentile(trend['durations'], 95)),
+                      format_ms(percentile(trend['engine'], 95)), outcomes[-1]])
+    return '\n'.join(table_lines(lines))
+
+
+def format_test_runs(runs, results):
+    """Format HistoryStore.test_runs() as a plain text table.
+
+    :param runs: HistoryStore.runs() the results are from
+    :rtype: str
+    """
+    started = dict((run['id'], run['started']) for run in runs)
+    header = ['STARTED', 'OUTCOME', 'MS', 'REQUESTS', 'ENGINE MS']
+    lines = [header]
+    for run_id, outcome, duration, requests, engine in results:
+        lines.append([time.strftime('%Y-%m-%d %H:%M', time.localtime(started[run_id])), str(outcome),
+                      format_ms(duration), str(requests), format_ms(engine)])
+    return '\n'.join(table_lines(lines))
+
+
+def format_latencies(latencies):
+    """Format HistoryStore.transaction_latencies() as a plain text table.
+
+    :rtype: str
+    """
+    header = ['TRANSACTION', 'COUNT', 'P50 MS', 'P95 MS', 'P99 MS']
+    lines = [header]
+    for kind, totals in sorted(latencies.items()):
+        lines.append([kind, str(len(totals)), format_ms(percentile(totals, 50)), format_ms(percentile(totals, 95)),
+                      format_ms(percentile(totals, 99))])
+    return '\n'.join(table_lines(lines))
@@ -0,0 +1,208 @@
+import threading
+import time
+from collections import OrderedDict
+from connection_pool import ConnectionPool
+from engine_request import EngineRequest
+from resilience import CircuitBreaker, CircuitOpen, RetryPolicy
+from stats import format_ms, summarize, table_lines
+
+
+# Transaction types, in conversation order
+INIT = 'init'
+SEMANTIC = 'semantic'
+DTREE = 'dtree'
+LIVE_CHAT = 'live_chat'
+CLOSE = 'close'
+TRANSACTIONS = (INIT, SEMANTIC, DTREE, LIVE_CHAT, CLOSE)
+
+# Waits of a user whose INIT failed; see RetryPolicy.delay
+INIT_BACKOFF = RetryPolicy(backoff=0.1, max_backoff=2.0)
+
+
+def conversation(config):
+    """Entries a simulated user sends after INIT, from the project config.
+
+    :param config: dict; project config
+    :rtype: list of (transaction type, entry)
+    """
+    turns = []
+    if config.get('semantic_input'):
+        turns.append((SEMANTIC, config['semantic_input']))
+    if config.get('dtree_input'):
+        turns.append((DTREE, config['dtree_input']))
+    for entry in config.get('live_chat_values', {}).get('live_chat_input', []):
+        turns.append((LIVE_CHAT, entry))
+    return turns
+
+
+class RateLimiter(object):
+    def __init__(self, rate):
+        """Spread calls to wait() evenly at rate per second across threads.
+
+        :param rate: float; 0 for no limit
+        """
+        self.interval = 1.0 / rate if rate else 0
+        self._next = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+
+        with self._lock:
+            now = time.time()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class LoadResults(object):
+    def __init__(self):
+        """Latencies and errors per transaction type, shared by every user.
+
+        Requests refused by the open circuit breaker never reached the
+        engine; they are counted as rejected, not as errors.
+        """
+        self.latencies = dict((t, []) for t in TRANSACTIONS)
+        self.errors = dict.fromkeys(TRANSACTIONS, 0)
+        self.rejected = dict.fromkeys(TRANSACTIONS, 0)
+        self.conversations = 0
+        self.duration = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, transaction, latency, ok):
+        with self._lock:
+            if ok:
+                self.latencies[transaction].append(latency)
+            else:
+                self.errors[transaction] += 1
+
+    def reject(self, transaction):
+        with self._lock:
+            self.rejected[transaction] += 1
+
+    def summary(self):
+        """Per transaction type stats. Latencies are in seconds.
+
+        :rtype: OrderedDict
+        """
+        summary = OrderedDict()
+        with self._lock:
+            for transaction in TRANSACTIONS:
+                stats = summarize(self.latencies[transaction])
+                total = stats['count'] + self.errors[transaction]
+                if not total and not self.rejected[transaction]:
+                    continue
+                stats['errors'] = self.errors[transaction]
+                stats['rejected'] = self.rejected[transaction]
+                stats['error_rate'] = self.errors[transaction] / float(total) if total else 0.0
+                stats['throughput'] = total / self.duration if self.duration else 0.0
+                summary[transaction] = stats
+        return summary
+
+
+def _timed(results, transaction, func, *args):
+    """Call func, recording its latency under transaction.
+
+    :return: func's return value, or None if it raised
+    """
+    start = time.time()
+    try:
+        value = func(*args)
+    except CircuitOpen:
+        results.reject(transaction)
+        return None
+    except Exception:
+        results.record(transaction, time.time() - start, False)
+        return None
+
+    results.record(transaction, time.time() - start, True)
+    return value
+
+
+def _close(engine, ident):
+    # A non blank close response is an engine error
+    if not engine.end_session(ident):
+        raise ValueError('Session %s was not closed' % ident)
+
+
+def _user(engine, turns, limiter, deadline, results):
+    """Run conversations back to back until the deadline."""
+    failures = 0
+    while time.time() < deadline:
+        limiter.wait()
+        init = _timed(results, INIT, engine.make_request)
+        ident = init.get('ident') if init is not None else None
+        if not ident:
+            # Don't spin against an engine that is down or an open breaker
+            time.sleep(min(INIT_BACKOFF.delay(failures), max(deadline - time.time(), 0)))
+            failures += 1
+            continue
+        failures = 0
+
+        for transaction, entry in turns:
+            if time.time() >= deadline:
+                break
+            limiter.wait()
+            _timed(results, transaction, engine.make_request, {'ident': ident, 'entry': entry})
+
+        limiter.wait()
+        _timed(results, CLOSE, _close, engine, ident)
+
+        with results._lock:
+            results.conversations += 1
+
+
+def run_load(endpoint, config, sessions=10, rate=0, duration=60, project=None):
+    """Drive concurrent conversations against endpoint.
+
+    :param endpoint: str; engine url
+    :param config: dict; project config providing the conversation inputs
+    :param sessions: int; number of concurrent conversations
+    :param rate: float; max transactions per second across all sessions, 0 for no limit
+    :param duration: float; seconds to run
+    :param project: str; project name passed to EngineRequest
+    :rtype: LoadResults
+    """
+    # Every error is measured as it happens: no retries, whose backoff would
+    # count as latency, and a breaker of its own, so one that opens here
+    # doesn't fail requests elsewhere in the process
+    engine = EngineRequest(endpoint, project=project, pool=ConnectionPool(maxsize=sessions), lazy=True,
+                           retry=RetryPolicy(0), breaker=CircuitBreaker(endpoint))
+    turns = conversation(config)
+    limiter = RateLimiter(rate)
+    results = LoadResults()
+
+    start = time.time()
+    deadline = start + duration
+    users = [threading.Thread(target=_user, args=(engine, turns, limiter, deadline, results))
+             for _ in range(sessions)]
+    for user in users:
+        user.daemon = True
+        user.start()
+    for user in users:
+        # join with a timeout so Ctrl-C still reaches the main thread
+        while user.is_alive():
+            user.join(1)
+
+    results.duration = time.time() - start
+    engine.pool.close()
+    return results
+
+
+def format_summary(summary):
+    """Format LoadResults.summary() as a plain text table.
+
+    :rtype: str
+    """
+    header = ['TRANSACTION', 'COUNT', 'ERRORS', 'ERROR %', 'REJECTED', 'TPS', 'P50 MS', 'P95 MS', 'P99 MS', 'MAX MS']
+    lines = [header]
+    for transaction, stats in summary.items():
+        lines.append([transaction, str(stats['count']), str(stats['errors']),
+                      '%.2f' % (stats['error_rate'] * 100), str(stats['rejected']), '%.1f' % stats['throughput'],
+                      format_ms(stats['p50']), format_ms(stats['p95']), format_ms(stats['p99']),
+                      format_ms(stats['max'])])
+
+    return '\n'.join(table_lines(lines))
@@ -0,0 +1,229 @@
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+
+try:
+    import xml.etree.cElementTree as cET
+except ImportError:
+    cET = None
+
+
+# Top level response tags whose children are parsed into a list of dicts,
+# mapped to the key they are stored under. Matched case insensitively,
+# except faqitems.
+LIST_KEYS = {
+    'connectors': 'connectors',
+    'disambiguationoptions': 'disambiguationoptions'
+}
+
+
+def _fix_text(text):
+    """Return ascii text as str, like ElementTree does on Python 2."""
+    try:
+        return text.encode('ascii')
+    except UnicodeError:
+        return text
+
+
+def _items(container):
+    """Parse the children of container into a list of {tag: text} dicts.
+
+    :param container: Element | None
+    :rtype: list | None; None when there are no children
+    """
+    if container is None or not len(container):
+        return None
+
+    return [dict((el.tag, el.text) for el in item) for item in container]
+
+
+def parse_child(child):
+    """Parse one top level element of an engine response.
+
+    :param child: Element
+    :rtype: tuple; (key, value) to store in the response dict
+    """
+    # related faqs
+    if child.tag == 'faqitems':
+        suggested = child.find('suggestedfaqlist')
+        related_list = suggested.find('semanticfaqs') if suggested is not None else None
+        return 'related_list', _items(related_list)
+
+    key = LIST_KEYS.get(child.tag.lower())
+    if key:
+        return key, _items(child)
+
+    return child.tag, child.text
+
+
+class ElementTreeParser(object):
+    """Builds the whole ElementTree then walks it."""
+    name = 'elementtree'
+    etree = ET
+
+    def parse(self, response):
+        """Parse an engine response into a dict.
+
+        :param response: str
+        :rtype: dict
+        """
+        return dict(parse_child(child) for child in self.etree.fromstring(response))
+
+    def iter_elements(self, response):
+        """Iterate over every element of the response.
+
+        :param response: str
+        :rtype: iterator
+        """
+        return self.etree.fromstring(response).iter()
+
+
+class CElementTreeParser(ElementTreeParser):
+    """ElementTreeParser using the C accelerated cElementTree."""
+    name = 'celementtree'
+    etree = cET
+
+
+class _ResponseBuilder(object):
+    """expat handlers building the response dict in a single pass.
+
+    Depth 1 is the root element, depth 2 the top level response tags.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.depth = 0
+
+        # Current top level tag and the text being collected
+        self.key = None
+        self.text = None
+        self.collecting = False
+
+        # List being built for faqitems/connectors/disambiguationoptions.
+        # list_depth is the depth of the element holding the items.
+        self.items = None
+        self.list_depth = None
+        self.is_list = False
+        self.field = None
+
+        # faqitems only uses its first suggestedfaqlist, like find()
+        self.suggested_seen = False
+        self.in_suggested = False
+
+    def start(self, tag, attrs):
+        self.depth += 1
+        depth = self.depth
+        tag = _fix_text(tag)
+
+        # An element's text stops at its first child
+        self.collecting = False
+
+        if depth == 2:
+            self.key = tag
+            self.text = []
+            self.collecting = True
+            self.items = None
+            self.list_depth = None
+            self.is_list = False
+
+            if tag == 'faqitems':
+                self.key = 'related_list'
+                self.is_list = True
+                self.suggested_seen = False
+            elif tag.lower() in LIST_KEYS:
+                self.key = LIST_KEYS[tag.lower()]
+                self.is_list = True
+                self.items = []
+                self.list_depth = 2
+
+        elif self.key == 'related_list' and depth == 3:
+            self.in_suggested = tag == 'suggestedfaqlist' and not self.suggested_seen
+            self.suggested_seen = self.suggested_seen or self.in_suggested
+
+        elif self.key == 'related_list' and depth == 4 and self.in_suggested:
+            if tag == 'semanticfaqs' and self.items is None:
+                self.items = []
+                self.list_depth = 4
+
+        elif self.list_depth is not None and depth == self.list_depth + 1:
+            self.items.append({})
+
+        elif self.list_depth is not None and depth == self.list_depth + 2:
+            self.field = tag
+            self.text = []
+            self.collecting = True
+
+    def end(self, tag):
+        depth = self.depth
+        self.depth -= 1
+
+        if depth == 2:
+            if self.is_list:
+                self.data[self.key] = self.items or None
+            else:
+                self.data[self.key] = self._text()
+
+        elif self.field is not None and depth == self.list_depth + 2:
+            self.items[-1][self.field] = self._text()
+            self.field = None
+
+        elif depth == self.list_depth:
+            # Left the semanticfaqs element; ignore anything after it
+            self.list_depth = None
+
+        elif depth == 3:
+            self.in_suggested = False
+
+        self.collecting = False
+
+    def characters(self, text):
+        if self.collecting:
+            self.text.append(text)
+
+    def _text(self):
+        if not self.text:
+            return None
+        return _fix_text(u''.join(self.text))
+
+
+class ExpatParser(ElementTreeParser):
+    """Streams the response through expat, building the dict in one pass
+    without creating an element tree."""
+    name = 'expat'
+
+    def parse(self, response):
+        builder = _ResponseBuilder()
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = builder.start
+        parser.EndElementHandler = builder.end
+        parser.CharacterDataHandler = builder.characters
+        parser.Parse(response, True)
+        return builder.data
+
+
+PARSERS = {
+    ElementTreeParser.name: ElementTreeParser,
+    ExpatParser.name: ExpatParser
+}
+
+if cET is not None:
+    PARSERS[CElementTreeParser.name] = CElementTreeParser
+
+
+def get_parser(parser=None):
+    """Return a response parser.
+
+    :param parser: backend name, parser instance, or None for the fastest
+    backend available
+        :type parser: str | object | None
+    """
+    if parser is None:
+        parser = CElementTreeParser.name if cET is not None else ExpatParser.name
+
+    if not isinstance(parser, basestring):
+        return parser
+
+    try:
+        return PARSERS[parser]()
+    except KeyError:
+        raise ValueError('Unknown parser "%s". Available: %s' % (parser, ', '.join(sorted(PARSERS))))
@@ -0,0 +1,193 @@
+import json
+import os
+from collections import namedtuple
+from history import HISTORY_FILE, HistoryStore, test_name
+from stats import format_ms, percentile, table_lines
+
+
+# Allowed p95 increase over the baseline, as a fraction
+DEFAULT_THRESHOLD = 0.2
+# Seconds; smaller increases are jitter, however large the fraction
+MIN_REGRESSION = 0.05
+# Transactions of a type needed in both the run and the baseline to compare them
+MIN_SAMPLES = 5
+# Latest runs of the previous kb version the baseline is built from
+BASELINE_RUNS = 10
+
+
+class Violation(namedtuple('Violation', 'transaction test p95 limit baseline')):
+    """A transaction type whose p95 latency went over its limit, in seconds.
+
+    test is None unless the budget is set for one test; baseline is the p95
+    of the baseline, or None when the limit is a budget from the config.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return '%s%s p95 %.1f ms over %.1f ms' % (self.transaction, ' in %s' % self.test if self.test else '',
+                                                   self.p95 * 1000, self.limit * 1000)
+
+
+class SlowInput(namedtuple('SlowInput', 'transaction entry now before')):
+    """An input whose median latency went over the limit, in seconds.
+
+    before is the median in the baseline, or None if it wasn't sent there.
+    """
+    __slots__ = ()
+
+
+Report = namedtuple('Report', 'violations inputs baseline_version baseline_runs')
+
+
+def load_transactions(path, target):
+    """Engine transactions of a target that didn't fail, from its timings file.
+
+    :param path: str; timings file written by results.TimingCollector
+    :param target: Target the timings are from
+    :return: list of {"test", "transaction", "total", "entry"} dicts
+    """
+    with open(path, 'r') as f:
+        transactions = json.loads(f.read())['transactions']
+    return [{'test': test_name(t['test'], target) if t['test'] else None,
+             'transaction': t['transaction'],
+             'total': t['total'],
+             'entry': t['entry']}
+            for t in transactions if not t['error']]
+
+
+def _by(transactions, key):
+    grouped = {}
+    for transaction in transactions:
+        grouped.setdefault(key(transaction), []).append(transaction['total'])
+    return grouped
+
+
+def _regressed(now, before, threshold):
+    return now > max(before * (1 + threshold), before + MIN_REGRESSION)
+
+
+def check(transactions, budgets=None, baseline=None, threshold=DEFAULT_THRESHOLD):
+    """Transaction types whose p95 latency is over budget, or regressed
+    beyond threshold from the baseline.
+
+    A budget set for a transaction type replaces the baseline comparison
+    of that type; a budget set for a test applies to that test's
+    transactions only.
+
+    :param transactions: transactions of the run, as from load_transactions
+    :param budgets: dict of transaction type: ms, or test: {transaction type: ms}
+    :param baseline: transactions to compare against
+    :param threshold: float; allowed p95 increase over the baseline, as a fraction
+    :rtype: list of Violation
+    """
+    budgets = budgets or {}
+    current = _by(transactions, lambda t: t['transaction'])
+    before = _by(baseline or [], lambda t: t['transaction'])
+
+    violations = []
+    for kind, totals in sorted(current.items()):
+        p95 = percentile(totals, 95)
+        if isinstance(budgets.get(kind), (int, float)):
+            if p95 > budgets[kind] / 1000.0:
+                violations.append(Violation(kind, None, p95, budgets[kind] / 1000.0, None))
+        elif len(totals) >= MIN_SAMPLES and len(before.get(kind, [])) >= MIN_SAMPLES:
+            old = percentile(before[kind], 95)
+            if _regressed(p95, old, threshold):
+                violations.append(Violation(kind, None, p95, max(old * (1 + threshold), old + MIN_REGRESSION), old))
+
+    for test, test_budgets in sorted(budgets.items()):
+        if not isinstance(test_budgets, dict):
+            continue
+        per_type = _by([t for t in transactions if t['test'] == test], lambda t: t['transaction'])
+        for kind, ms in sorted(test_budgets.items()):
+            p95 = percentile(per_type.get(kind, []), 95)
+            if p95 is not None and p95 > ms / 1000.0:
+                violations.append(Violation(kind, test, p95, ms / 1000.0, None))
+    return violations
+
+
+def slow_inputs(transactions, violations, baseline=None, threshold=DEFAULT_THRESHOLD, limit=10):
+    """Inputs behind the violations, slowest change first.
+
+    An input sent in the baseline too is slow when its median latency
+    regressed beyond threshold; any other when its median is over the
+    violation's limit.
+
+    :param transactions: transactions of the run, as from load_transactions
+    :param violations: list of Violation from check
+    :param baseline: transactions the run was compared against
+    :param limit: int; most inputs returned
+    :rtype: list of SlowInput
+    """
+    before = _by([t for t in baseline or [] if t['entry']], lambda t: (t['transaction'], t['entry']))
+
+    slow = {}
+    for violation in violations:
+        now = _by([t for t in transactions if t['entry'] and t['transaction'] == violation.transaction and
+                   violation.test in (None, t['test'])], lambda t: (t['transaction'], t['entry']))
+        for key, totals in now.items():
+            median = percentile(totals, 50)
+            old = percentile(before[key], 50) if key in before else None
+            if (_regressed(median, old, threshold) if old is not None else median > violation.limit):
+                slow[key] = SlowInput(key[0], key[1], median, old)
+
+    return sorted(slow.values(), key=lambda s: s.now - (s.before or 0), reverse=True)[:limit]
+
+
+def evaluate(target, config, timings_path, threshold=DEFAULT_THRESHOLD, history_path=HISTORY_FILE):
+    """Gate a target's run on the budgets in its project config, and on
+    the latest runs of the previous kb version in the test history.
+
+    :param target: Target
+    :param config: dict; project config, with optional "latency_budgets"
+    :param timings_path: str; timings file of the run
+    :param threshold: float; allowed p95 increase over the baseline, as a fraction
+    :param history_path: str; sqlite test history
+    :rtype: Report
+    """
+    transactions = load_transactions(timings_path, target)
+
+    baseline, version, runs = [], None, []
+    if os.path.exists(history_path):
+        store = HistoryStore(history_path)
+        try:
+            version = store.previous_version(target.project, target.environment, config.get('version_number'))
+            if version is not None:
+                runs = store.runs(target.project, target.environment, BASELINE_RUNS, version)
+                baseline = store.transactions([run['id'] for run in runs])
+        finally:
+            store.close()
+
+    violations = check(transactions, config.get('latency_budgets'), baseline, threshold)
+    inputs = slow_inputs(transactions, violations, baseline, threshold) if violations else []
+    return Report(violations, inputs, version, len(runs))
+
+
+def format_report(report):
+    """Format a Report as plain text.
+
+    :rtype: str
+    """
+    lines = []
+    if report.baseline_version is not None:
+        lines.append('Baseline: %d runs at kb version %s' % (report.baseline_runs, report.baseline_version))
+    else:
+        lines.append('Baseline: none; only latency budgets are checked')
+    if not report.violations:
+        lines.append('No latency regressions')
+        return '\n'.join(lines)
+
+    rows = [['TRANSACTION', 'TEST', 'P95 MS', 'LIMIT MS', 'BASELINE P95 MS']]
+    for v in report.violations:
+        rows.append([v.transaction, v.test or '-', format_ms(v.p95), format_ms(v.limit), format_ms(v.baseline)])
+    lines.extend(table_lines(rows))
+
+    if report.inputs:
+        rows = [['TRANSACTION', 'INPUT', 'MEDIAN MS', 'BASELINE MS', 'CHANGE']]
+        for s in report.inputs:
+            change = '+%.0f%%' % ((s.now - s.before) / s.before * 100) if s.before else '-'
+            rows.append([s.transaction, '"%s"' % s.entry, format_ms(s.now), format_ms(s.before), change])
+        lines.append('')
+        lines.append('Slower inputs:')
+        lines.extend(table_lines(rows))
+    return '\n'.join(lines)
@@ -0,0 +1,227 @@
+import copy
+import errno
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+CONFIG_DIRECTORY = os.path.join(DIRECTORY, 'project_configs')
+
+# Kept outside project_configs so it is never mistaken for a project
+INDEX_FILE = os.path.join(DIRECTORY, '.project_index.json')
+# Here rather than in response_cache, so checking for it doesn't load sqlite3
+CACHE_FILE = os.path.join(DIRECTORY, '.response_cache.sqlite')
+
+
+def file_name_for(project):
+    """Config file name of a project.
+
+    :rtype: str
+    """
+    return '%s.json' % project.lower().strip().replace(' ', '_')
+
+
+def write_json(path, data):
+    """Write data as json to path atomically; readers see the old file or
+    the new one, never a partial write.
+    """
+    # Unique per writer, so concurrent writers never share a partial file
+    tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.current_thread().ident)
+    with open(tmp, 'w') as f:
+        f.write(json.dumps(data, indent=2, sort_keys=True))
+    os.rename(tmp, path)
+
+
+@contextmanager
+def file_lock(path, timeout=30, stale=60):
+    """Hold an exclusive lock on path, across processes, by creating
+    path.lock. Wrap a read, update and write_json of a file shared by
+    concurrent runs so no run's update is lost.
+
+    :param path: str; file to lock
+    :param timeout: seconds to wait for the lock before taking it anyway
+    :param stale: seconds after which a lock left by a crashed run is ignored
+    """
+    lock = '%s.lock' % path
+    directory = os.path.dirname(lock)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    expires = time.time() + timeout
+    while True:
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        try:
+            if time.time() - os.path.getmtime(lock) > stale:
+                os.remove(lock)
+                continue
+        except OSError:
+            continue
+        if time.time() > expires:
+            break
+        time.sleep(0.05)
+
+    try:
+        yield
+    finally:
+        try:
+            os.remove(lock)
+        except OSError:
+            pass
+
+
+class ProjectRegistry(object):
+    def __init__(self, directory=CONFIG_DIRECTORY, index_file=INDEX_FILE):
+        """Project configs, indexed by file.
+
+        The index keeps each config file's mtime and size along with the
+        project name, endpoints and version number, so listing projects only
+        parses files that changed since the index was written. Loaded configs
+        are cached in memory until their file changes.
+
+        :param directory: str; directory holding <project>.json config files
+        :param index_file: str | None; where the index is persisted between
+        runs. None keeps it in memory only.
+        """
+        self.directory = directory
+        self.index_file = index_file
+
+        self._index = None
+        self._configs = {}
+        self._lock = threading.RLock()
+
+    def _read_index(self):
+        if self.index_file and os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, 'r') as f:
+                    index = json.loads(f.read())
+                if index.get('directory') == self.directory:
+                    return index['files']
+            except (IOError, ValueError, KeyError):
+                pass
+        return {}
+
+    def _write_index(self):
+        if not self.index_file:
+            return
+        try:
+            write_json(self.index_file, {'directory': self.directory, 'files': self._index})
+        except (IOError, OSError):
+            # The index is only a cache; a read only install still works
+            pass
+
+    @staticmethod
+    def _entry(config, stat):
+        return {
+            'name': config.get('name', 'ERROR'),
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'endpoints': config.get('endpoints', {}),
+            'version_number': config.get('version_number')
+        }
+
+    def index(self):
+        """Index entry per config file name, refreshed for files whose mtime
+        or size changed.
+
+        :rtype: dict
+        """
+        with self._lock:
+            if self._index is None:
+                self._index = self._read_index()
+
+            changed = False
+            files = set(f for f in os.listdir(self.directory) if f.endswith('.json'))
+
+            for file_name in set(self._index) - files:
+                del self._index[file_name]
+                changed = True
+
+            for file_name in files:
+                stat = os.stat(os.path.join(self.directory, file_name))
+                entry = self._index.get(file_name)
+                if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                    continue
+                try:
+                    config = self.load(file_name)
+                except ValueError:
+                    config = {}
+                self._index[file_name] = self._entry(config, stat)
+                changed = True
+
+            if changed:
+                self._write_index()
+            return dict(self._index)
+
+    def projects(self):
+        """Project names, ordered by config file name.
+
+        :rtype: list
+        """
+        index = self.index()
+        return [index[f]['name'] for f in sorted(index)]
+
+    def path_for(self, project):
+        """Config file of a project, by file name or by the name in its config.
+
+        :rtype: str
+        """
+        file_name = project if project.endswith('.json') else file_name_for(project)
+        path = os.path.join(self.directory, file_name)
+        if os.path.exists(path):
+            return path
+
+        for f, entry in self.index().items():
+            if entry['name'].lower() == project.lower():
+                return os.path.join(self.directory, f)
+        return path
+
+    def exists(self, project):
+        return os.path.exists(self.path_for(project))
+
+    def load(self, project):
+        """Config of a project. Raises IOError if there is none, ValueError
+        if it isn't valid json.
+
+        Each call returns a new copy, so callers may change it freely.
+
+        :param project: str; project name or config file name
+        :rtype: dict
+        """
+        path = self.path_for(project)
+        stat = os.stat(path) if os.path.exists(path) else None
+        with self._lock:
+            cached = self._configs.get(path)
+            if stat is None or cached is None or cached[0] != (stat.st_mtime, stat.st_size):
+                with open(path, 'r') as f:
+                    config = json.loads(f.read())
+                cached = self._configs[path] = ((stat.st_mtime, stat.st_size), config)
+            return copy.deepcopy(cached[1])
+
+    def save(self, project, config):
+        """Atomically write a project's config and update the index.
+
+        :param project: str; project name or config file name
+        :param config: dict
+        :return: the config file path
+            :rtype: str
+        """
+        path = self.path_for(project)
+        with self._lock:
+            write_json(path, config)
+            self._configs.pop(path, None)
+            if self._index is not None:
+                self._index[os.path.basename(path)] = self._entry(config, os.stat(path))
+                self._write_index()
+        return path
+
+
+# Registry of the project_configs directory shipped with the package
+default_registry = ProjectRegistry()
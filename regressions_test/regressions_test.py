@@ -18,28 +18,45 @@ Commands:
 # TODO add create new project command
 
 import sys
-import urllib2
-import pytest
 import json
 import argparse
 import os
-from engine_request import EngineRequest
-from shutil import copy
-from collections import namedtuple
+from registry import CACHE_FILE, default_registry as registry
+
+# pytest, the engine client and everything else a command needs are imported
+# in the command itself, so commands that only read and write configs start
+# quickly.
 
 
 # Constants
 DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 
-# Get version number from version file
-d = os.path.join(*os.path.split(DIRECTORY)[:-1])
-try:
-    with open(os.path.join(d, 'VERSION'), 'rb') as f:
-        __version__ = f.read().decode('utf-8').strip()
-except Exception, e:
-    __version__ = "ERROR"
-    print(d)
-    print(e)
+
+
+def get_version():
+    """
+    Version number from the VERSION file.
+    :return: str
+    """
+    d = os.path.join(*os.path.split(DIRECTORY)[:-1])
+    try:
+        with open(os.path.join(d, 'VERSION'), 'rb') as f:
+            return f.read().decode('utf-8').strip()
+    except Exception, e:
+        print(d)
+        print(e)
+        return "ERROR"
+
+
+class VersionAction(argparse.Action):
+    """--version action that only reads the VERSION file when --version is given."""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+        super(VersionAction, self).__init__(option_strings=option_strings, dest=dest, default=default,
+                                            nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        parser.exit(message='%s-%s\n' % (parser.prog, get_version()))
 
 
 def create_parser():
@@ -56,8 +73,7 @@ def create_parser():
     # Main parser; has commands sub parser
     main_parser = argparse.ArgumentParser(description='Regressions testing module for core script projects.')
     main_parser.add_argument('--version',
-                             action='version',
-                             version='%(prog)s-' + __version__,
+                             action=VersionAction,
                              help='Show version number of currently installed package.')
 
     commands = main_parser.add_subparsers(metavar='COMMANDS')
@@ -85,15 +101,74 @@ def create_parser():
     # test command
     tester = commands.add_parser('test',
                                  parents=[parser],
-                                 help='Run tests')
+                                 help='Run tests',
+                                 description='Run tests. PROJECT may also be a comma separated list of '
+                                             'projects, or "all"; every endpoint is tested in one pytest run.')
     tester.add_argument('environment', nargs='?', default='staging',
                         help='Environment in which to run regressions tests')
     # tester.add_argument('--all', dest='ALL', action='store_true', help='if present run all rts for <project>')
     tester.add_argument('-V', '--version_number', type=int, default=0, metavar='version_number',
                         help='Version number of kb to be tested.')
     tester.add_argument('-a', dest='all', action='store_true', help='Run tests on all known endpoints.')
+    tester.add_argument('-p', '--parallel', action='store_true',
+                        help='Test endpoints at the same time in pytest-xdist worker processes, one per endpoint.')
+    # consts are cassette.RECORD and cassette.REPLAY
+    cassette_args = tester.add_mutually_exclusive_group()
+    cassette_args.add_argument('--record', dest='cassette', action='store_const', const='record',
+                               help='Record every engine request and response to a cassette for the environment.')
+    cassette_args.add_argument('--replay', dest='cassette', action='store_const', const='replay',
+                               help='Run tests against the recorded cassette; no engine is contacted.')
+    tester.add_argument('--cache', action='store_true',
+                        help='Serve faq lookups from the response cache when they were answered '
+                             'before for the same kb version.')
+    tester.add_argument('--scenario-concurrency', type=int, default=None, metavar='N',
+                        help='Number of config scenarios run at the same time. Defaults to 8.')
+    tester.add_argument('--changed-only', action='store_true',
+                        help='Only run tests whose config values, endpoint, kb version or source changed '
+                             'since they last passed.')
+    tester.add_argument('--timeout', type=float, default=None, metavar='SECONDS',
+                        help='Seconds an engine connect or read may take before the request fails. '
+                             'Defaults to 30.')
+    tester.add_argument('--retries', type=int, default=2, metavar='N',
+                        help='Retries, with jittered backoff, of INIT and session close requests after a '
+                             'connection error, timeout or 5xx response. Defaults to %(default)s.')
+    tester.add_argument('--deadline', type=float, default=None, metavar='SECONDS',
+                        help='Time budget of the whole run. Once spent, remaining engine requests fail '
+                             'immediately instead of waiting on the engine.')
+    tester.add_argument('--shard-index', type=int, default=0, metavar='K',
+                        help='Run shard K, from 0 to N - 1, of the tests.')
+    tester.add_argument('--shard-count', type=int, default=1, metavar='N',
+                        help='Split the tests of every target into N shards of about the same duration, '
+                             'from stored test durations. Every shard must be given the same projects, '
+                             'endpoints and durations file.')
+    tester.add_argument('--shard-output', default=None, metavar='FILE',
+                        help='Partial result file of the shard, for the merge command. '
+                             'Defaults to shards/shard-K-of-N.json.')
+    tester.add_argument('--no-history', dest='history', action='store_false',
+                        help="Don't record the run in the test history.")
+    # const is perf_gate.DEFAULT_THRESHOLD as a percentage
+    tester.add_argument('--perf-gate', type=float, nargs='?', const=20.0, default=None, metavar='PERCENT',
+                        help='Fail the run when the p95 latency of a transaction type is over its budget in the '
+                             'project config, or more than PERCENT (default 20) above the latest recorded runs '
+                             'of the previous kb version.')
     tester.set_defaults(func=test)
 
+    # load command
+    _load = commands.add_parser('load',
+                                parents=[parser],
+                                help='Load test an endpoint with concurrent conversations.')
+    _load.add_argument('environment', nargs='?', default='staging',
+                       help='Environment to load test.')
+    _load.add_argument('-s', '--sessions', type=int, default=10,
+                       help='Number of concurrent conversations.')
+    _load.add_argument('-r', '--rate', type=float, default=0,
+                       help='Max requests per second across all conversations. 0 for no limit.')
+    _load.add_argument('-d', '--duration', type=float, default=60,
+                       help='Seconds to run.')
+    _load.add_argument('-o', '--output', type=argparse.FileType('w'), default=None,
+                       help='Also write the results as json to this file.')
+    _load.set_defaults(func=load)
+
     # show command
     _show = commands.add_parser('show',
                                 parents=[parser],
@@ -116,6 +191,84 @@ def create_parser():
                                 )
     _update_config.set_defaults(func=update_config)
 
+    # corpus command
+    _corpus = commands.add_parser('corpus',
+                                  parents=[parser],
+                                  help='Send every utterance in a csv or jsonl file to an endpoint.')
+    _corpus.add_argument('environment', help='Environment to send the utterances to.')
+    _corpus.add_argument('file', help='Csv or jsonl file of utterances.')
+    _corpus.add_argument('-o', '--output', default=None,
+                         help='Jsonl file results are written to. Defaults to FILE.results.jsonl.')
+    _corpus.add_argument('-c', '--concurrency', type=int, default=8,
+                         help='Number of utterances sent at the same time.')
+    _corpus.add_argument('-t', '--turns-per-session', type=int, default=20,
+                         help='Utterances sent on one engine session before a new one is opened.')
+    _corpus.add_argument('-r', '--resume', action='store_true',
+                         help='Continue an interrupted run from its last checkpoint.')
+    _corpus.set_defaults(func=corpus)
+
+    # snapshot command
+    _snapshot = commands.add_parser('snapshot',
+                                    parents=[parser],
+                                    help="Record the response to every config input for the project's kb version.")
+    _snapshot.add_argument('environment', nargs='?', default='staging',
+                           help='Environment to record.')
+    _snapshot.add_argument('-c', '--concurrency', type=int, default=8,
+                           help='Number of conversations recorded at the same time.')
+    _snapshot.set_defaults(func=snapshot)
+
+    # diff command
+    _diff = commands.add_parser('diff',
+                                parents=[parser],
+                                help='Compare the snapshots of two kb versions field by field.')
+    _diff.add_argument('old', nargs='?', default=None,
+                       help='Kb version to compare from. Defaults to the second newest snapshot.')
+    _diff.add_argument('new', nargs='?', default=None,
+                       help='Kb version to compare to. Defaults to the newest snapshot.')
+    _diff.add_argument('-e', '--environment', default='staging',
+                       help='Environment the snapshots were recorded on.')
+    _diff.set_defaults(func=diff)
+
+    # merge command
+    _merge = commands.add_parser('merge',
+                                 help='Combine the partial result files of a sharded test run.')
+    _merge.add_argument('files', nargs='+', help='Partial result files, one per shard.')
+    _merge.add_argument('-o', '--output', default=None, help='Write the merged results as json to this file.')
+    _merge.add_argument('--no-durations', dest='durations', action='store_false',
+                        help="Don't add the shards' test durations to the stored durations.")
+    _merge.set_defaults(func=merge)
+
+    # history command
+    _history = commands.add_parser('history',
+                                   parents=[parser],
+                                   help='Show the trends of recorded test runs.')
+    _history.add_argument('environment', nargs='?', default=None,
+                          help='Only show runs against this environment.')
+    _history.add_argument('-n', '--runs', type=int, default=30, help='Number of latest runs to show.')
+    _history.add_argument('-t', '--test', default=None,
+                          help='Show one test in every run, e.g. main_tests.py::test_semantic.')
+    _history.set_defaults(func=history)
+
+    # simulate command
+    _simulate = commands.add_parser('simulate',
+                                    help='Run a local stand in engine for benchmarking and offline testing.')
+    _simulate.add_argument('--host', default='127.0.0.1', help='Interface to listen on.')
+    _simulate.add_argument('--port', type=int, default=8080, help='Port to listen on.')
+    _simulate.add_argument('--latency', action='append', default=[], metavar='ROUTE=MS',
+                           help='Response latency in ms for a route (init, entry, faq, close, or all). Repeatable.')
+    _simulate.add_argument('--jitter', action='append', default=[], metavar='ROUTE=MS',
+                           help='Random extra latency in ms, up to MS, for a route. Repeatable.')
+    _simulate.add_argument('--error-rate', action='append', default=[], metavar='ROUTE=RATE',
+                           help='Fraction of requests to a route answered with HTTP 500. Repeatable.')
+    _simulate.add_argument('--semantic-faqs', type=int, default=5, help='Related faqs returned for an entry.')
+    _simulate.add_argument('--connectors', type=int, default=3, help='Connectors returned for an entry.')
+    _simulate.add_argument('--disambiguation-options', type=int, default=0,
+                           help='Disambiguation options returned for an entry.')
+    _simulate.add_argument('--version-number', default='1', help='KB version reported for "versionnumber".')
+    _simulate.add_argument('--live-chat-skill', default='general', help='Skill returned when live chat is requested.')
+    _simulate.add_argument('-v', '--verbose', action='store_true', help='Log every request.')
+    _simulate.set_defaults(func=simulate)
+
     # create project command
     _create_project = commands.add_parser('create_project',
                                           help='Create new project to be tested')
@@ -153,8 +306,24 @@ def test(args):
     :param args: Pertinent args: version_number, environment, project.
     :return:
     """
+    import time
+    import pytest
+    from connection_pool import default_pool
+    from engine_request import DEFAULT_TIMEOUT, default_tracker, run_concurrently
+    from resilience import Deadline, RetryPolicy
+    import sharding
+    from results import ResultCollector, format_table
+    from targets import Target, applies_to
+
+    sharded = args.shard_count > 1
+    if not 0 <= args.shard_index < args.shard_count:
+        sys.exit('--shard-index must be from 0 to %d.' % (args.shard_count - 1))
+    if args.perf_gate is not None and args.cassette == 'replay':
+        sys.exit("--perf-gate measures engine latency; it can't be used with --replay.")
+
+    projects = _projects(args.project)
     # if captured version number is valid rn tests using that if not prompt user to update
-    if args.version_number == 0:
+    if args.version_number == 0 and len(projects) == 1:
         try:
             v_num = input("Enter kb version number (Press enter to re-run last test): ")
             update_version_number(int(v_num), args)
@@ -163,63 +332,251 @@ def test(args):
             print 'Testing against last saved version.'
         except SyntaxError:
             pass
+    elif args.version_number and len(projects) > 1:
+        sys.exit('-V can only be given when testing a single project.')
 
-    try:
-        # set up project params
-        config = json.loads(open('%s/project_configs/%s.json' % (DIRECTORY,
-                                                                 args.project.lower())).read())
-    except ValueError, e:
-        print 'Error while reading config file: %s' % e
-    except IOError, e:
-        print '%s; Be sure regressions tests have been set up for this project.' % e
-        print DIRECTORY
-
-    project = config.get('name')
-    # Gather endpoints
-    if not args.all and config.get('endpoints').get(args.environment):
-        endpoints = [{
-            'ep': config['endpoints'][args.environment],
-            'env': args.environment
-        }]
-    else:
-        endpoints = [{'ep': ep, 'env': env} for env, ep in config.get('endpoints', {}).items()]
-
-    # Run tests for each endpoint available requested
-    for test_point in endpoints:
-        environment = test_point['env']
-        endpoint = test_point['ep']
-        print 'Testing project: %s; Using endpoint: %s' % (project, environment)
-        # make first request to the engine. this response is used in most of those tests
+    # Gather endpoints of every project
+    endpoints = []
+    for name in projects:
         try:
-            req = EngineRequest(endpoint).make_request()
-        except urllib2.HTTPError, e:
-            if e.code == 404:
-                sys.exit('Bad Endpoint: %s' % endpoint)
-            else:
-                sys.exit(e)
-
-        # if response returns correctly run tests
-        if req.get('ident'):
-            # TODO add kb version number to print statement on test initialization.
-            print 'Session initiated targeting endpoint: %s' % endpoint
-            print 'Session Id: %s' % req['ident']
-            params = {'ident': req['ident'],
-                      'entry': ''}
+            # set up project params
+            config = registry.load(name)
+        except ValueError, e:
+            sys.exit('Error while reading %s config file: %s' % (name, e))
+        except IOError, e:
+            print '%s; Be sure regressions tests have been set up for this project.' % e
+            sys.exit(DIRECTORY)
+
+        project = config.get('name')
+        if not args.all and config.get('endpoints', {}).get(args.environment):
+            endpoints.append((Target(project, args.environment), config['endpoints'][args.environment]))
+        elif args.all or len(projects) == 1:
+            endpoints.extend((Target(project, env), ep) for env, ep in sorted(config.get('endpoints', {}).items()))
+
+    timeout = args.timeout if args.timeout is not None else DEFAULT_TIMEOUT
+    engine_options = {'timeout': timeout,
+                      'retry': RetryPolicy(args.retries),
+                      'deadline': Deadline(args.deadline) if args.deadline else None}
+
+    # Make sure every endpoint answers before any test runs; one that
+    # doesn't is reported without stopping the others
+    checked = run_concurrently(lambda e: _check_endpoint(e[0], e[1], args.cassette, engine_options),
+                               endpoints, max(len(endpoints), 1))
+    rows = []
+    targets = []
+    excluded = []
+    for (target, endpoint), (row, output) in zip(endpoints, checked):
+        print output
+        rows.append(row)
+        if row.get('message'):
+            print row['message']
+            excluded.append(target)
         else:
-            print 'Failed to initiate session. Response: %s' % req
-
-        # list of params to pass pytest; add custom tests if available for project
-        tests = ['-v',
-                 '--project=%s' % project,
-                 '--environment=%s' % environment,
-                 '--params=%s' % json.dumps(params),
-                 '%s/tests/main_tests.py' % DIRECTORY]
+            targets.append(target)
+
+    collector = ResultCollector(targets)
+    distributed = False
+    if targets:
+        # list of params to pass pytest; add custom tests available for the projects.
+        # Targets that can't be tested are still collected, then excluded, so
+        # every shard splits the same tests.
+        tests = ['-v'] + ['--target=%s:%s' % t for t, _ in endpoints] + ['%s/tests/main_tests.py' % DIRECTORY]
+        tests.extend('--exclude-target=%s:%s' % t for t in excluded)
         custom_test_dir = os.path.join(DIRECTORY, 'tests')
-        custom_tests = [os.path.join(custom_test_dir, f) for f in os.listdir(custom_test_dir) if project.lower() in f.lower()]
-        tests.extend(custom_tests)
+        tests.extend(os.path.join(custom_test_dir, f) for f in sorted(os.listdir(custom_test_dir))
+                     if f.endswith('_custom_test.py') and any(applies_to(f, t.project) for t, _ in endpoints))
+        if sharded:
+            tests.extend(['--shard-index=%d' % args.shard_index, '--shard-count=%d' % args.shard_count])
+
+        if args.cassette:
+            tests.append('--%s' % args.cassette)
+        if args.cache:
+            tests.append('--response-cache')
+        if args.changed_only:
+            tests.append('--changed-only')
+        if not args.history:
+            tests.append('--no-history')
+        if args.scenario_concurrency:
+            tests.append('--scenario-concurrency=%d' % args.scenario_concurrency)
+        tests.extend(['--engine-timeout=%s' % timeout, '--engine-retries=%d' % args.retries])
+        if engine_options['deadline']:
+            tests.append('--deadline=%.3f' % max(engine_options['deadline'].remaining(), 0.001))
+        if args.parallel and len(targets) > 1:
+            try:
+                import xdist  # only checks that pytest-xdist is installed
+                # Each worker runs whole targets; see conftest.pytest_xdist_make_scheduler
+                tests.extend(['-n', str(len(targets)), '--dist=loadscope'])
+                distributed = True
+            except ImportError:
+                print 'pytest-xdist is not installed; testing endpoints in one process. ' \
+                      'Reinstall regressions_test, or pip install pytest-xdist, to test them in parallel.'
         print tests
 
-        pytest.main(tests)
+        started = time.time()
+        pytest.main(tests, plugins=[collector])
+
+    for row, target in zip(rows, [t for t, _ in endpoints]):
+        if not row.get('message'):
+            row.update(collector.summary(target))
+
+    if args.perf_gate is not None:
+        import perf_gate
+        from results import timings_path_for
+        for row, target in zip(rows, [t for t, _ in endpoints]):
+            path = timings_path_for(target.project, target.environment)
+            # Targets that made no engine requests this run have no new timings
+            if row.get('message') or not os.path.exists(path) or os.path.getmtime(path) < started:
+                continue
+            report = perf_gate.evaluate(target, registry.load(target.project), path, args.perf_gate / 100.0)
+            print 'Latency gate for %s:' % (target,)
+            print perf_gate.format_report(report)
+            if report.violations:
+                row['message'] = 'Latency regression in %s: %s' % (target, '; '.join(map(str, report.violations)))
+
+    if sharded:
+        path = args.shard_output or sharding.shard_path_for(args.shard_index, args.shard_count)
+        sharding.write_partial(path, args.shard_index, args.shard_count, rows, collector.tests)
+        print 'Shard %d of %d results written to %s' % (args.shard_index, args.shard_count, path)
+    else:
+        # Shards only read stored durations, so they all split tests the same way
+        sharding.save_durations(dict((nodeid, test['duration']) for nodeid, test in collector.tests.items()))
+
+    # xdist workers save their own cassettes
+    if args.cassette and not distributed:
+        import cassette as cassettes
+        for target in targets:
+            cassette = cassettes.load(cassettes.path_for(target.project, target.environment), args.cassette)
+            cassette.save()
+            stats = cassette.stats()
+            print 'Cassette %s (%s): %s interactions, %s replayed' % (
+                stats['mode'], target, stats['interactions'], stats['replayed'])
+
+    print 'Engine connections opened: %(created)s; reused: %(reused)s; evicted: %(evicted)s' % default_pool.stats()
+    # With -p the tests open their sessions in xdist workers; only the endpoint checks' are counted here
+    sessions = 'Engine sessions opened by the endpoint checks' if distributed else 'Engine sessions opened'
+    print sessions + ': %(opened)s; closed: %(closed)s; failed to close: %(failed)s' % default_tracker.stats()
+
+    if len(rows) > 1:
+        print format_table(rows)
+
+    failed = [row for row in rows if row.get('message')]
+    if failed:
+        sys.exit(failed[0]['message'] if len(rows) == 1 else 1)
+
+
+def merge(args):
+    """
+    Combine the partial result files of a sharded test run and print one summary table.
+    :param args: Pertinent args: files, output, durations
+    """
+    import sharding
+    from results import format_table
+
+    rows, tests, problems = sharding.merge(args.files)
+    print format_table(rows)
+    for problem in problems:
+        print problem
+
+    if args.durations:
+        sharding.save_durations(dict((nodeid, test['duration']) for nodeid, test in tests.items()))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'rows': rows, 'tests': tests, 'problems': problems}, f, indent=2, sort_keys=True)
+
+    if problems or any(row.get('message') for row in rows):
+        sys.exit(1)
+
+
+def history(args):
+    """
+    Print the latest recorded runs of a project, the trend of every test and engine transaction latencies.
+    :param args: Pertinent args: project, environment, runs, test
+    """
+    import history as histories
+
+    if not os.path.exists(histories.HISTORY_FILE):
+        sys.exit('No test runs recorded yet.')
+
+    # Runs are recorded under the name in the config, not the file name
+    project = registry.load(args.project).get('name', args.project)
+    store = histories.HistoryStore()
+    try:
+        runs = store.runs(project, args.environment, args.runs)
+        if not runs:
+            sys.exit('No recorded runs of %s%s.' % (project, ': %s' % args.environment if args.environment else ''))
+        run_ids = [run['id'] for run in runs]
+
+        print histories.format_runs(runs)
+        print
+        if args.test:
+            print histories.format_test_runs(runs, store.test_runs(run_ids, args.test))
+            print
+            print histories.format_latencies(store.transaction_latencies(run_ids, args.test))
+        else:
+            print histories.format_trends(store.test_trends(run_ids))
+            print
+            print histories.format_latencies(store.transaction_latencies(run_ids))
+    finally:
+        store.close()
+
+
+def _projects(value):
+    """
+    Project names given on the command line.
+    :param value: str; a project, a comma separated list of projects, or "all"
+    :return: list
+    """
+    if value == 'all':
+        return list_projects()
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def _check_endpoint(target, endpoint, cassette_mode=None, engine_options=None):
+    """
+    Open and close a session on endpoint, to find out if it can be tested.
+    :param target: Target
+    :param endpoint: str; endpoint url
+    :param cassette_mode: None, cassettes.RECORD or cassettes.REPLAY
+    :param engine_options: dict; timeout, retry and deadline of the EngineRequest
+    :return: tuple; (row, output). row is a dict with a message if the endpoint could not be tested
+    """
+    import urllib2
+    import cassette as cassettes
+    from engine_request import EngineRequest
+
+    row = {'project': target.project, 'environment': target.environment}
+    output = ['Testing project: %s; Using endpoint: %s' % (target.project, target.environment)]
+
+    cassette = None
+    if cassette_mode:
+        try:
+            cassette = cassettes.load(cassettes.path_for(target.project, target.environment), cassette_mode)
+        except cassettes.CassetteError, e:
+            row['message'] = str(e)
+            return row, '\n'.join(output)
+
+    engine = EngineRequest(endpoint, pool=cassette, **engine_options or {})
+    try:
+        req = engine.make_request()
+    except urllib2.HTTPError, e:
+        if e.code == 404:
+            row['message'] = 'Bad Endpoint: %s' % endpoint
+        else:
+            row['message'] = str(e)
+        return row, '\n'.join(output)
+    except (urllib2.URLError, cassettes.CassetteError), e:
+        row['message'] = str(e)
+        return row, '\n'.join(output)
+
+    if req.get('ident'):
+        # TODO add kb version number to print statement on test initialization.
+        output.append('Session initiated targeting endpoint: %s' % endpoint)
+        output.append('Session Id: %s' % req['ident'])
+        engine.close_session(req['ident'])
+    else:
+        output.append('Failed to initiate session. Response: %s' % req)
+        row['message'] = 'Failed to initiate session'
+    return row, '\n'.join(output)
 
 
 def show(args):
@@ -227,9 +584,7 @@ def show(args):
     Print list of selected config vars.
     :param args: Pertinent args: project, var
     """
-    directory = os.path.join(DIRECTORY, 'project_configs', '%s.json' % args.project.lower())
-    with open(directory, 'r') as f:
-        config = json.loads(f.read())
+    config = registry.load(args.project)
 
     if args.var == 'all':
         print json.dumps(config, indent=2, sort_keys=True)
@@ -252,15 +607,9 @@ def add_endpoint(args):
     Add endpoint to project
     :param args: Pertinent args: project, name, url.
     """
-
-    directory = os.path.join(DIRECTORY, 'project_configs', '%s.json' % args.project.lower())
-    with open(directory, 'r') as f:
-        new_json = json.loads(f.read())
-
+    new_json = registry.load(args.project)
     new_json['endpoints'][args.name] = args.url
-
-    with open(directory, 'w') as f:
-        f.write(json.dumps(new_json, indent=2, sort_keys=True))
+    registry.save(args.project, new_json)
 
     print 'Added endpoint', args.name, args.url, 'to',  args.project
 
@@ -272,18 +621,18 @@ def update_version_number(num=None, args=None):
     :param num: int; new kb version number to be updated in project config file
     :return:
     """
-
     num = num if num else args.version_number
 
-    directory = os.path.join(DIRECTORY, 'project_configs', '%s.json' % args.project.lower())
-
-    with open(directory, 'r') as f:
-        new_json = json.loads(f.read())
-
+    new_json = registry.load(args.project)
     new_json['version_number'] = str(num)
+    registry.save(args.project, new_json)
 
-    with open(directory, 'w') as f:
-        f.write(json.dumps(new_json, indent=2, sort_keys=True))
+    # Answers cached for the previous kb version can't be trusted anymore
+    if os.path.exists(CACHE_FILE):
+        import response_cache
+        cache = response_cache.ResponseCache()
+        cache.purge(new_json.get('endpoints', {}).values(), keep_version=num)
+        cache.close()
 
     print 'Version number updated to:', num
 
@@ -291,11 +640,8 @@ def update_version_number(num=None, args=None):
 def update_config(args):
     """Update config variable"""
 
-    directory = os.path.join(DIRECTORY, 'project_configs', '%s.json' % args.project.lower())
-
     try:
-        with open(directory, 'r') as f:
-            config = json.loads(f.read())
+        config = registry.load(args.project)
     except IOError, io:
         print('Could not load config file for %s' % args.project)
         print('ERROR: %s' % io)
@@ -343,28 +689,199 @@ def update_config(args):
         print('%s %s' % (m, key))
 
     try:
-        with open(directory, 'w') as f:
-            f.write(json.dumps(config, indent=2, sort_keys=True))
+        registry.save(args.project, config)
     except Exception, e:
         print('%s: %s' % (e.__repr__(), e))
         exit()
 
 
+def load(args):
+    """
+    Run concurrent conversations built from the project config against an endpoint
+    and report throughput, errors and latency percentiles per transaction type.
+    :param args: Pertinent args: project, environment, sessions, rate, duration, output
+    """
+    import load as loader
+
+    try:
+        config = registry.load(args.project)
+    except (ValueError, IOError), e:
+        sys.exit('Error while reading config file: %s' % e)
+
+    endpoint = config.get('endpoints', {}).get(args.environment)
+    if not endpoint:
+        sys.exit('No %s endpoint in %s config.' % (args.environment, args.project))
+
+    print 'Load testing %s: %s with %d sessions for %ss%s' % (
+        config.get('name'), args.environment, args.sessions, args.duration,
+        ' at %s requests/s' % args.rate if args.rate else '')
+    results = loader.run_load(endpoint, config, sessions=args.sessions, rate=args.rate,
+                              duration=args.duration, project=config.get('name'))
+    summary = results.summary()
+
+    print loader.format_summary(summary)
+    print 'Conversations completed: %d in %.1fs' % (results.conversations, results.duration)
+
+    if args.output:
+        json.dump({'project': config.get('name'),
+                   'environment': args.environment,
+                   'sessions': args.sessions,
+                   'rate': args.rate,
+                   'duration': results.duration,
+                   'conversations': results.conversations,
+                   'transactions': summary}, args.output, indent=2)
+        args.output.close()
+
+
+def corpus(args):
+    """
+    Stream a corpus of utterances through an endpoint, writing a result line per utterance.
+    :param args: Pertinent args: project, environment, file, output, concurrency, turns_per_session, resume
+    """
+    import corpus as corpora
+
+    try:
+        config = registry.load(args.project)
+    except (ValueError, IOError), e:
+        sys.exit('Error while reading config file: %s' % e)
+
+    endpoint = config.get('endpoints', {}).get(args.environment)
+    if not endpoint:
+        sys.exit('No %s endpoint in %s config.' % (args.environment, args.project))
+    output = args.output or '%s.results.jsonl' % os.path.splitext(args.file)[0]
+
+    def progress(counts):
+        sys.stderr.write('\r%(sent)d sent, %(errors)d errors, %(answered)d answered' % counts)
+
+    print 'Sending %s to %s: %s; results in %s' % (args.file, config.get('name'), args.environment, output)
+    try:
+        counts = corpora.run_corpus(endpoint, args.file, output, concurrency=args.concurrency,
+                                    turns_per_session=args.turns_per_session, resume=args.resume,
+                                    project=config.get('name'), progress=progress)
+    except KeyboardInterrupt:
+        sys.exit('\nInterrupted; continue with --resume')
+    except IOError, e:
+        sys.exit(str(e))
+
+    sys.stderr.write('\n')
+    rate = counts['sent'] / counts['duration'] if counts['duration'] else 0
+    print '%(sent)d utterances sent, %(errors)d errors, %(answered)d answered' % counts
+    if counts['resumed_after']:
+        print 'Resumed after line %(resumed_after)d' % counts
+    print '%.1fs; %.1f utterances/s' % (counts['duration'], rate)
+
+
+def snapshot(args):
+    """
+    Record the parsed response to every input in the project config, stored under the config's kb version.
+    :param args: Pertinent args: project, environment, concurrency
+    """
+    import snapshot as snapshots
+
+    try:
+        config = registry.load(args.project)
+    except (ValueError, IOError), e:
+        sys.exit('Error while reading config file: %s' % e)
+
+    endpoint = config.get('endpoints', {}).get(args.environment)
+    if not endpoint:
+        sys.exit('No %s endpoint in %s config.' % (args.environment, args.project))
+
+    version_number = config.get('version_number', 'unknown')
+    print 'Recording %s: %s at kb version %s' % (config.get('name'), args.environment, version_number)
+    responses, errors = snapshots.take(endpoint, config, args.concurrency)
+    for name, error in sorted(errors.items()):
+        print 'Failed to record %s: %s' % (name, error)
+
+    path = snapshots.path_for(config.get('name'), args.environment, version_number)
+    snapshots.save(path, config.get('name'), args.environment, version_number, responses)
+    print 'Saved %d responses to %s' % (len(responses), path)
+
+
+def diff(args):
+    """
+    Print every difference between the snapshots of two kb versions.
+    :param args: Pertinent args: project, environment, old, new
+    """
+    import snapshot as snapshots
+
+    project = registry.load(args.project).get('name', args.project)
+    available = snapshots.versions(project, args.environment)
+    old, new = args.old, args.new
+    if new is None:
+        recorded = [v for v in available if v != old]
+        if len(recorded) < (1 if old else 2):
+            sys.exit('Not enough snapshots of %s: %s to compare. Recorded versions: %s'
+                     % (project, args.environment, ', '.join(available) or 'none'))
+        new = recorded[-1]
+        if old is None:
+            old = recorded[-2]
+
+    for version in (old, new):
+        if version not in available:
+            sys.exit('No snapshot of %s: %s at kb version %s. Recorded versions: %s'
+                     % (project, args.environment, version, ', '.join(available) or 'none'))
+
+    old_responses = snapshots.load(snapshots.path_for(project, args.environment, old))
+    new_responses = snapshots.load(snapshots.path_for(project, args.environment, new))
+    differences = snapshots.diff(old_responses, new_responses)
+
+    for difference in differences:
+        print difference
+    changed = len(set(d.input for d in differences))
+    print '%s: %s kb version %s -> %s: %d of %d responses differ' % (
+        project, args.environment, old, new, changed, len(set(old_responses) | set(new_responses)))
+
+
+def simulate(args):
+    """
+    Serve a simulated engine until interrupted.
+    :param args: Pertinent args: host, port, latency, jitter, error_rate, semantic_faqs, connectors,
+    disambiguation_options, version_number, live_chat_skill, verbose
+    """
+    import simulator
+
+    routes = dict((name, simulator.Route()) for name in simulator.ROUTES)
+
+    for setting, values, cast in (('latency', args.latency, float),
+                                  ('jitter', args.jitter, float),
+                                  ('error_rate', args.error_rate, float)):
+        for value in values:
+            try:
+                route, number = value.split('=')
+                number = cast(number)
+            except ValueError:
+                sys.exit('Expected ROUTE=NUMBER, got: %s' % value)
+
+            if route != 'all' and route not in routes:
+                sys.exit('Unknown route: %s. Routes: %s, all' % (route, ', '.join(simulator.ROUTES)))
+            for name in (simulator.ROUTES if route == 'all' else [route]):
+                setattr(routes[name], setting, number)
+
+    engine = simulator.SimulatedEngine(host=args.host, port=args.port, routes=routes,
+                                       semantic_faqs=args.semantic_faqs,
+                                       connectors=args.connectors,
+                                       disambiguation_options=args.disambiguation_options,
+                                       version_number=args.version_number,
+                                       live_chat_skill=args.live_chat_skill,
+                                       verbose=args.verbose)
+    print 'Simulated engine listening on %s' % engine.url
+    try:
+        engine.serve_forever()
+    except KeyboardInterrupt:
+        print engine.stats()
+
+
 def list_projects(args=None):
     """
-    List all projects by reading the config files in the project_configs folder
+    List all projects from the project registry index
     :return:
     """
 
-    directory = os.path.join(DIRECTORY, 'project_configs')
-    config_files = os.listdir(directory)
-
-    files = list()
-    for _file in config_files:
-        with open(os.path.join(directory, _file), 'r') as f:
-            js = json.loads(f.read())
-            print(js.get('name', 'ERROR'))
-            files.append(js.get('name', 'ERROR'))
+    files = registry.projects()
+    if args is not None:
+        for name in files:
+            print(name)
 
     return files
 
@@ -377,14 +894,12 @@ def create_project(args):
     """
 
     tests_dir = os.path.join(DIRECTORY, 'tests')
-    config_dir = os.path.join(DIRECTORY, 'project_configs')
 
     # handle config creation based on vars
     if args.BLANK_CONFIG:
         project_name = raw_input('Project name:  ').lower().strip().replace(' ', '_')
         if not project_name: raise ValueError('Project name is required.')
-        with open(os.path.join(config_dir, '%s.json' % project_name), 'w') as f:
-            f.writelines(json.dumps({"name": project_name}, indent=2))
+        registry.save(project_name, {"name": project_name})
 
     elif args.config_file:
         try:
@@ -395,8 +910,7 @@ def create_project(args):
             if not config.get('name'):
                 raise Exception('"name" is a required value')
 
-            new_file_name = config['name'].lower().strip().replace(' ', '_')
-            copy(args.config_file.name, os.path.join(config_dir, new_file_name))
+            registry.save(config['name'], config)
 
         except Exception, e:
             print('%s: %s' % (type(e), e))
@@ -405,15 +919,11 @@ def create_project(args):
     elif args.clone_project_config:
         org_project, new_project = args.clone_project_config
         try:
-            if org_project.strip() not in list_projects(): raise Exception('%s project not found.' % org_project)
-            new_file_name = new_project.lower().strip().replace(' ', '_')
-            copy(os.path.join(DIRECTORY, 'project_configs', '%s.json' % org_project.lower().replace(' ', '_')),
-                 os.path.join(DIRECTORY, 'project_configs', '%s.json' % new_file_name))
-
-            fake_args = namedtuple('fake_args', 'FROM_FILE, OVERWRITE, json, project')
-            js = json.dumps({"name": new_project})
-
-            update_config(fake_args(FROM_FILE=False, OVERWRITE=True, json=js, project=new_project))
+            if not registry.exists(org_project.strip()): raise Exception('%s project not found.' % org_project)
+            config = registry.load(org_project.strip())
+            config['name'] = new_project
+            registry.save(new_project, config)
+            print('Updated name')
 
         except Exception, e:
             print('%s' % e)
@@ -421,8 +931,6 @@ def create_project(args):
     # step through each config var one by one
     else:
         project_name = raw_input("Project name:  ")
-        new_file_name = project_name.lower().strip().replace(' ', '_')
-
         semantic_input = raw_input("Semantic trigger:  ").strip()
         dtree_input = raw_input("Dtree trigger:  ").strip()
 
@@ -462,8 +970,7 @@ def create_project(args):
         }
 
         try:
-            with open(os.path.join(config_dir, '%s.json' % new_file_name), 'w') as f:
-                f.write(json.dumps(js, indent=2, sort_keys=True))
+            registry.save(project_name, js)
 
         except Exception, e:
             print(e)
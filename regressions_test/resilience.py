@@ -0,0 +1,156 @@
+import random
+import threading
+import time
+import urllib2
+
+
+# Status codes that mean the engine, not the request, is at fault
+RETRY_CODES = (500, 502, 503, 504)
+
+
+class DeadlineExceeded(urllib2.URLError):
+    """The run's deadline passed before a request could be sent."""
+
+
+class CircuitOpen(urllib2.URLError):
+    """Requests to an endpoint are being refused after repeated failures."""
+
+
+def is_engine_failure(error):
+    """True if error means the engine is down or struggling: a connection
+    error, a timeout or a 5xx status. 4xx errors mean the engine answered.
+
+    :param error: urllib2.URLError
+    :rtype: bool
+    """
+    if isinstance(error, (DeadlineExceeded, CircuitOpen)):
+        return False
+    if isinstance(error, urllib2.HTTPError):
+        return error.code in RETRY_CODES
+    return True
+
+
+class Deadline(object):
+    def __init__(self, seconds):
+        """Time budget shared by every request of a run.
+
+        :param seconds: seconds from now until the deadline
+            :type seconds: int | float
+        """
+        self.seconds = seconds
+        self.expires = time.time() + seconds
+
+    def remaining(self):
+        """:rtype: float; seconds left, never below 0"""
+        return max(0.0, self.expires - time.time())
+
+    def timeout(self, timeout=None):
+        """Timeout for the next request: timeout, cut down to the time left.
+
+        :raises DeadlineExceeded: if the deadline has passed
+        :rtype: float
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded('Deadline of %ss exceeded' % self.seconds)
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
+
+
+class RetryPolicy(object):
+    def __init__(self, retries=2, backoff=0.2, max_backoff=2.0):
+        """How often, and how long apart, idempotent requests are retried.
+
+        Waits use "full jitter": a random time between 0 and
+        backoff * 2 ** attempt, capped at max_backoff, so many sessions
+        retrying at once don't hit a recovering engine in lockstep.
+
+        :param retries: retries after the first attempt; 0 disables retrying
+        :param backoff: seconds; the cap of the first wait
+        :param max_backoff: seconds; the largest wait
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt):
+        """Seconds to wait before retry number attempt + 1.
+
+        :rtype: float
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+    def __init__(self, endpoint, failure_threshold=5, reset_timeout=30):
+        """Fail fast on an endpoint that is clearly down.
+
+        After failure_threshold engine failures in a row the breaker opens
+        and requests fail immediately with CircuitOpen. Once reset_timeout
+        seconds have passed one trial request is let through; it closes the
+        breaker if it succeeds and reopens it otherwise.
+
+        :param endpoint: str; endpoint url
+        :param failure_threshold: int
+        :param reset_timeout: seconds
+        """
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.failures = 0
+        self.opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """"closed", "open" or "half-open"."""
+        if self.opened is None:
+            return 'closed'
+        if time.time() - self.opened >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before(self):
+        """Call before sending a request.
+
+        :raises CircuitOpen: if requests to the endpoint are refused
+        """
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return
+            if state == 'half-open' and not self._trial:
+                self._trial = True
+                return
+        raise CircuitOpen('Circuit open for %s after %d failures' % (self.endpoint, self.failures))
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened = time.time()
+            self._trial = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(endpoint):
+    """The CircuitBreaker shared by every request to endpoint.
+
+    :rtype: CircuitBreaker
+    """
+    with _breakers_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker(endpoint)
+        return _breakers[endpoint]
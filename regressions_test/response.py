@@ -0,0 +1,240 @@
+import re
+from array import array
+from collections import Mapping
+from xml.parsers import expat
+from parsers import LIST_KEYS, cET, parse_child, ET
+
+
+# Element tree used to decode single fields
+_etree = cET if cET is not None else ET
+
+# Bytes; below this, scanning the offsets costs more than parsing the whole
+# response, so smaller ones are parsed up front. A faq-less init is 1.3 KB,
+# a response listing 10 faqs 2.8 KB.
+EAGER_SIZE = 4096
+
+_START_TAG = re.compile(r'<([^\s/>!?]+)[^>]*?(/?)>')
+# An element holding nothing but text, or an empty one; most top level
+# fields are, and one match finds their whole span
+_LEAF = re.compile(r'<([^\s/>!?]+)[^>]*?(?:/>|>[^<]*</\1>)')
+
+
+_keys = {}
+
+
+def _key(tag):
+    """Response dict key a top level tag is stored under, interned."""
+    try:
+        return _keys[tag]
+    except KeyError:
+        key = 'related_list' if tag == 'faqitems' else LIST_KEYS.get(tag.lower(), tag)
+        key = _keys[tag] = intern(key)
+        return key
+
+
+def _scan(raw):
+    """Find the byte span of every top level element using string searches.
+
+    :param raw: str; engine response
+    :rtype: tuple; (root start, [(tag, start, end), ...]) or None when the
+    response uses something the scan can't skip safely (doctypes, nested
+    tags of the same name); _expat_scan handles those.
+    """
+    root = _START_TAG.search(raw)
+    if root is None or root.group(2):
+        return (root.start() if root else 0), []
+
+    spans = []
+    pos = root.end()
+    leaf = _LEAF.match
+    while True:
+        m = leaf(raw, pos)
+        if m is not None:
+            spans.append((m.group(1), pos, m.end()))
+            pos = m.end()
+            continue
+
+        lt = raw.find('<', pos)
+        if lt == -1 or raw.startswith('</', lt):
+            break
+        if raw.startswith('<!--', lt):
+            pos = raw.index('-->', lt) + 3
+            continue
+        if raw.startswith('<?', lt):
+            pos = raw.index('?>', lt) + 2
+            continue
+        if raw.startswith('<!', lt):
+            return None
+
+        m = leaf(raw, lt)
+        if m is not None:
+            spans.append((m.group(1), lt, m.end()))
+            pos = m.end()
+            continue
+
+        m = _START_TAG.match(raw, lt)
+        tag = m.group(1)
+        if m.group(2):
+            end = m.end()
+        else:
+            # The end tag may also appear as text in a CDATA section
+            search = m.end()
+            while True:
+                close = raw.find('</%s>' % tag, search)
+                cdata = raw.find('<![CDATA[', search, close)
+                if close == -1 or cdata == -1:
+                    break
+                search = raw.index(']]>', cdata) + 3
+
+            if close == -1 or raw.find('<%s' % tag, m.end(), close) != -1:
+                return None
+            end = close + len(tag) + 3
+
+        spans.append((tag, lt, end))
+        pos = end
+
+    return root.start(), spans
+
+
+def _expat_scan(raw):
+    """Same as _scan, using expat byte offsets. Slower, always correct."""
+    spans = []
+    starts = []
+    state = {'depth': 0, 'root': 0}
+    parser = expat.ParserCreate()
+
+    def start(tag, attrs):
+        state['depth'] += 1
+        if state['depth'] == 1:
+            state['root'] = parser.CurrentByteIndex
+        elif state['depth'] == 2:
+            starts.append(parser.CurrentByteIndex)
+
+    def end(tag):
+        if state['depth'] == 2:
+            index = parser.CurrentByteIndex
+            # The end event of <tag/> points at the start tag itself
+            if raw.startswith('</', index) or index == starts[-1]:
+                index = raw.index('>', index) + 1
+            spans.append((tag.encode('utf-8'), starts.pop(), index))
+        state['depth'] -= 1
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.Parse(raw, True)
+    return state['root'], spans
+
+
+class EngineResponse(object):
+    """Read only, dict like view of an engine response.
+
+    Only the position of each top level tag is recorded up front; a field
+    is parsed the first time it is read. Values are the same as the ones
+    in the dict returned by EngineRequest.parse_response.
+
+    Scanning costs about as much as parsing a 3 KB response, and reading
+    one field of a larger one is faster than parsing all of it (4 KB:
+    0.1 ms against 0.15 ms, 16 KB: 0.1 ms against 0.5 ms). Responses under
+    EAGER_SIZE are parsed whole right away instead.
+    """
+    __slots__ = ('_raw', '_keys', '_offsets', '_values')
+
+    def __init__(self, raw):
+        """
+        :param raw: str; engine response xml
+        """
+        if isinstance(raw, unicode):
+            raw = raw.encode('utf-8')
+
+        if len(raw) < EAGER_SIZE:
+            self._raw = raw
+            self._values = dict(parse_child(child) for child in _etree.fromstring(raw))
+            self._keys = tuple(self._values)
+            self._offsets = None
+            return
+
+        scanned = _scan(raw)
+        root, spans = scanned if scanned is not None else _expat_scan(raw)
+
+        offsets = [root]
+        for _, start, end in spans:
+            offsets.append(start)
+            offsets.append(end)
+
+        self._raw = raw
+        self._keys = tuple([_key(tag) for tag, _, _ in spans])
+        self._offsets = array('l', offsets)
+        self._values = None
+
+    def _index(self, key):
+        """Offset index of key's element; the last one wins, like a dict."""
+        keys = self._keys
+        for i in range(len(keys) - 1, -1, -1):
+            if keys[i] == key:
+                return i
+        raise KeyError(key)
+
+    def __getitem__(self, key):
+        if self._values is not None and key in self._values:
+            return self._values[key]
+
+        i = self._index(key)
+        start, end = self._offsets[2 * i + 1], self._offsets[2 * i + 2]
+        # Keep the xml declaration so the fragment decodes the same way
+        fragment = self._raw[:self._offsets[0]] + self._raw[start:end]
+        value = parse_child(_etree.fromstring(fragment))[1]
+
+        if self._values is None:
+            self._values = {}
+        self._values[key] = value
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(set(self._keys))
+
+    def keys(self):
+        seen = set()
+        return [k for k in self._keys if not (k in seen or seen.add(k))]
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def to_dict(self):
+        """Decode every field.
+
+        :rtype: dict
+        """
+        return dict(self.items())
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def __eq__(self, other):
+        if isinstance(other, EngineResponse):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<EngineResponse %s>' % ', '.join(self.keys())
+
+
+Mapping.register(EngineResponse)
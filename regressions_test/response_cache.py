@@ -0,0 +1,140 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import urllib
+from registry import CACHE_FILE
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    endpoint TEXT NOT NULL,
+    version TEXT,
+    ident TEXT,
+    body BLOB NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+CREATE INDEX IF NOT EXISTS responses_endpoint ON responses (endpoint, version);
+"""
+
+
+def cache_key(endpoint, params, version):
+    """Key of a request; the session ident is left out so any session can
+    reuse a cached answer.
+
+    :rtype: str
+    """
+    params = sorted((str(k), unicode(v).encode('utf-8') if isinstance(v, unicode) else str(v))
+                    for k, v in (params or {}).items() if k != 'ident')
+    return hashlib.sha1('%s\n%s\n%s' % (endpoint, version, urllib.urlencode(params))).hexdigest()
+
+
+class ResponseCache(object):
+    def __init__(self, path=CACHE_FILE, ttl=24 * 60 * 60, max_entries=10000):
+        """On disk cache of raw engine responses, keyed by endpoint, params
+        and kb version number.
+
+        Entries older than ttl are never returned. Once more than
+        max_entries are stored, the least recently used are evicted.
+
+        :param path: str; sqlite database file
+        :param ttl: seconds an entry stays valid
+        :param max_entries: int
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.text_factory = str
+        self._db.executescript(SCHEMA)
+
+    def get(self, endpoint, params, version):
+        """Cached response for a request, or None.
+
+        The ident of the session the response was cached for is swapped for
+        the ident in params, the same way cassettes replay responses.
+
+        :rtype: str | None
+        """
+        key = cache_key(endpoint, params, version)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT ident, body, created FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None or now - row[2] > self.ttl:
+                if row is not None:
+                    self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+
+            self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self._db.commit()
+            self.hits += 1
+
+        cached_ident, body = row[0], str(row[1])
+        ident = (params or {}).get('ident')
+        if cached_ident and ident and cached_ident != ident:
+            body = body.replace(cached_ident, str(ident))
+        return body
+
+    def put(self, endpoint, params, version, body):
+        """Cache the response to a request, evicting the least recently used
+        entries if the cache is full.
+        """
+        key = cache_key(endpoint, params, version)
+        now = time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (key, endpoint, None if version is None else str(version),
+                              (params or {}).get('ident'), sqlite3.Binary(body), now, now))
+            count = self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            if count > self.max_entries:
+                self._db.execute('DELETE FROM responses WHERE key IN '
+                                 '(SELECT key FROM responses ORDER BY accessed LIMIT ?)',
+                                 (count - self.max_entries,))
+            self._db.commit()
+
+    def purge(self, endpoints=None, keep_version=None):
+        """Delete cached responses.
+
+        :param endpoints: list; only purge these endpoints. Defaults to all.
+        :param keep_version: keep entries cached for this version number
+        :return: number of entries deleted
+            :rtype: int
+        """
+        where, args = [], []
+        if endpoints is not None:
+            endpoints = list(endpoints)
+            if not endpoints:
+                return 0
+            where.append('endpoint IN (%s)' % ', '.join('?' * len(endpoints)))
+            args.extend(endpoints)
+        if keep_version is not None:
+            where.append('(version IS NULL OR version != ?)')
+            args.append(str(keep_version))
+
+        query = 'DELETE FROM responses'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+
+        with self._lock:
+            deleted = self._db.execute(query, args).rowcount
+            self._db.commit()
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            return {'entries': entries, 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,258 @@
+import json
+import os
+import threading
+import time
+import pytest
+import engine_request
+from stats import format_ms, summarize, table_lines
+from targets import target_of
+
+
+OUTCOMES = ('passed', 'failed', 'error', 'skipped')
+
+TIMINGS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'timings')
+
+
+class ResultCollector(object):
+    """pytest plugin counting test outcomes for a single run, in total
+    and per target.
+
+    Pass an instance to pytest.main(plugins=[...]) and read .summary()
+    once the run is over.
+    """
+
+    def __init__(self, targets=()):
+        """
+        :param targets: list of Target the run's tests are parametrized over
+        """
+        self.targets = list(targets)
+        self.counts = dict.fromkeys(OUTCOMES, 0)
+        self.target_counts = dict((t, dict.fromkeys(OUTCOMES, 0)) for t in self.targets)
+        self.target_durations = dict.fromkeys(self.targets, 0.0)
+        self.tests = {}
+        self.started = None
+        self.duration = 0.0
+
+    def pytest_sessionstart(self, session):
+        self.started = time.time()
+
+    def pytest_sessionfinish(self, session, exitstatus):
+        self.duration = time.time() - self.started
+
+    def pytest_runtest_logreport(self, report):
+        if report.when == 'call':
+            outcome = report.outcome
+        elif report.when == 'setup' and report.outcome == 'skipped':
+            outcome = 'skipped'
+        elif report.failed:
+            # Failures outside the test body are fixture errors
+            outcome = 'error'
+        else:
+            outcome = None
+
+        test = self.tests.setdefault(report.nodeid, {'outcome': None, 'duration': 0.0})
+        test['duration'] += report.duration
+        target = target_of(report.nodeid, self.targets)
+        if target is not None:
+            self.target_durations[target] += report.duration
+        if outcome is None:
+            return
+        if test['outcome'] in (None, 'passed'):
+            test['outcome'] = outcome
+        self.counts[outcome] += 1
+        if target is not None:
+            self.target_counts[target][outcome] += 1
+
+    def summary(self, target=None):
+        """Outcome counts plus the duration in seconds, of the run or of
+        one target's tests.
+
+        :param target: Target
+        :rtype: dict
+        """
+        if target is None:
+            summary = dict(self.counts)
+            summary['duration'] = self.duration
+        else:
+            summary = dict(self.target_counts[target])
+            summary['duration'] = self.target_durations[target]
+        return summary
+
+
+def format_table(rows):
+    """Format per endpoint results as a plain text table.
+
+    :param rows: list of dicts with project, environment, outcome counts,
+    duration, and a message if the endpoint could not be tested
+    :rtype: str
+    """
+    header = ['PROJECT', 'ENVIRONMENT', 'RESULT'] + [o.upper() for o in OUTCOMES] + ['TIME']
+    lines = [header]
+    for row in rows:
+        if row.get('message'):
+            result = 'ERROR'
+        elif row.get('failed') or row.get('error'):
+            result = 'FAILED'
+        else:
+            result = 'OK'
+        lines.append([row['project'], row['environment'], result] +
+                     [str(row.get(o, 0)) for o in OUTCOMES] +
+                     ['%.1fs' % row.get('duration', 0)])
+
+    table = table_lines(lines)
+
+    # Errors that kept an endpoint from running are listed under the table
+    for row in rows:
+        if row.get('message'):
+            table.append('%s %s: %s' % (row['project'], row['environment'], row['message']))
+
+    return '\n'.join(table)
+
+
+def timings_path_for(project, environment):
+    """Timings file for a project's environment.
+
+    :rtype: str
+    """
+    name = '%s_%s.json' % (project.lower().replace(' ', '_'), environment)
+    return os.path.join(TIMINGS_DIRECTORY, name)
+
+
+class TimingCollector(object):
+    """pytest plugin recording a Timing for every engine request made
+    during the run, attributed to the test that was running.
+
+    Requests made while session fixtures are set up or torn down count
+    towards the test that triggered them.
+    """
+
+    def __init__(self, path=None, slowest=10, targets=()):
+        """
+        :param path: str; json file every timing is written to. Defaults to
+        a file per target, see timings_path_for.
+        :param slowest: int; number of slowest transactions to print
+        :param targets: list of Target the run's tests are parametrized over
+        """
+        self.path = path
+        self.slowest = slowest
+        self.targets = list(targets)
+        self.written = []
+        self.records = []
+        self.current = None
+        self._lock = threading.Lock()
+
+    def record(self, timing):
+        with self._lock:
+            self.records.append((self.current, timing))
+
+    def pytest_sessionstart(self, session):
+        engine_request.timing_hooks.append(self.record)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item, nextitem):
+        self.current = item.nodeid
+        yield
+        self.current = None
+
+    def pytest_sessionfinish(self, session, exitstatus):
+        if self.record in engine_request.timing_hooks:
+            engine_request.timing_hooks.remove(self.record)
+        if self.path:
+            self.save(self.path)
+            return
+
+        for target in self.targets:
+            # Only targets that ran here; with xdist, other workers write the rest
+            if any(target_of(test or '', self.targets) == target for test, _ in self.records):
+                self.save(timings_path_for(target.project, target.environment), target)
+
+    def _records(self, target=None):
+        with self._lock:
+            if target is None:
+                return list(self.records)
+            return [(test, timing) for test, timing in self.records
+                    if target_of(test or '', self.targets) == target]
+
+    def _group(self, key, target=None):
+        """Request count, engine time and parse time per key.
+
+        :param key: callable taking (test, timing)
+        :param target: only count the requests of this target's tests
+        :rtype: dict
+        """
+        groups = {}
+        for test, timing in self._records(target):
+            groups.setdefault(key(test, timing), []).append(timing)
+
+        summary = {}
+        for name, timings in groups.items():
+            summary[name] = {
+                'requests': len(timings),
+                'errors': sum(1 for t in timings if t.error),
+                'engine': sum(t.connect + t.ttfb + t.download for t in timings),
+                'parse': sum(t.parse for t in timings),
+                'bytes_received': sum(t.bytes_received for t in timings),
+                'ttfb': summarize([t.ttfb for t in timings])
+            }
+        return summary
+
+    def per_test(self, target=None):
+        return self._group(lambda test, timing: test, target)
+
+    def per_endpoint(self, target=None):
+        return self._group(lambda test, timing: timing.endpoint, target)
+
+    def save(self, path, target=None):
+        """Write every timing, or a target's, plus per test and per
+        endpoint totals as json."""
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        transactions = [dict(timing._asdict(), test=test) for test, timing in self._records(target)]
+        payload = {'transactions': transactions,
+                   'tests': self.per_test(target),
+                   'endpoints': self.per_endpoint(target)}
+
+        tmp = '%s.tmp' % path
+        with open(tmp, 'w') as f:
+            json.dump(payload, f, indent=2, sort_keys=True)
+        os.rename(tmp, path)
+        self.written.append(path)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if not self.records:
+            return
+
+        write = terminalreporter.write_line
+        terminalreporter.section('engine timings')
+
+        slowest = sorted(self.records, key=lambda r: r[1].total, reverse=True)[:self.slowest]
+        lines = [['TOTAL MS', 'CONNECT', 'TTFB', 'DOWNLOAD', 'PARSE', 'KB', 'TRANSACTION', 'TEST']]
+        for test, t in slowest:
+            lines.append([format_ms(t.total), format_ms(t.connect), format_ms(t.ttfb), format_ms(t.download),
+                          format_ms(t.parse),
+                          '%.1f' % (t.bytes_received / 1024.0),
+                          t.transaction + (' "%s"' % t.entry if t.entry else '') + (' ERROR' if t.error else ''),
+                          test or '-'])
+        write('Slowest %d engine transactions:' % len(slowest))
+        for line in table_lines(lines):
+            write(line)
+
+        lines = [['ENGINE MS', 'PARSE MS', 'REQUESTS', 'TEST']]
+        tests = sorted(self.per_test().items(), key=lambda i: i[1]['engine'], reverse=True)
+        for test, stats in tests:
+            lines.append([format_ms(stats['engine']), format_ms(stats['parse']), str(stats['requests']), test or '-'])
+        write('')
+        write('Engine time per test:')
+        for line in table_lines(lines):
+            write(line)
+
+        for endpoint, stats in sorted(self.per_endpoint().items()):
+            write('')
+            write('%s: %d requests, %d errors, %s ms engine, %s ms parsing, ttfb p50 %s ms, p95 %s ms' % (
+                endpoint, stats['requests'], stats['errors'], format_ms(stats['engine']), format_ms(stats['parse']),
+                format_ms(stats['ttfb']['p50']), format_ms(stats['ttfb']['p95'])))
+
+        for path in self.written:
+            write('Timings written to %s' % path)
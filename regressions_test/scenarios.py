@@ -0,0 +1,156 @@
+"""
+Multi turn conversation scenarios from the "scenarios" list of a project config:
+
+    "scenarios": [
+      {
+        "name": "live chat handoff",
+        "turns": [
+          {"entry": "billing", "expect": {"section": "Answer"}},
+          {"faq": {"recognition_id": "12", "answer_id": "34"}, "expect": {"answerID": "34"}},
+          {"entry": "live chat", "expect": {"livechatrequested": "true", "botanswer": "re:.*agent.*"}}
+        ]
+      }
+    ]
+
+Each scenario runs on its own session. A turn sends its entry, or an faq
+request when "faq" is given, and its response must match every "expect"
+field. Expected strings starting with "re:" are matched as regular
+expressions; null expects the field to be empty.
+"""
+
+import re
+import time
+from collections import namedtuple
+from engine_request import run_concurrently
+
+
+REGEX_PREFIX = 're:'
+
+
+class TurnResult(namedtuple('TurnResult', 'index entry latency failures error')):
+    """Outcome of one turn; failures lists the fields that didn't match."""
+    __slots__ = ()
+
+    @property
+    def passed(self):
+        return not self.failures and not self.error
+
+
+class ScenarioResult(namedtuple('ScenarioResult', 'name ident turns error')):
+    """Outcome of one scenario; error is set if no session could be opened."""
+    __slots__ = ()
+
+    @property
+    def passed(self):
+        return not self.error and all(t.passed for t in self.turns)
+
+    def report(self):
+        """One line per turn.
+
+        :rtype: str
+        """
+        lines = ['Scenario: %s; Session id: %s' % (self.name, self.ident)]
+        if self.error:
+            lines.append('  ERROR %s' % self.error)
+        for turn in self.turns:
+            status = 'PASS' if turn.passed else 'FAIL'
+            lines.append('  %s turn %d "%s" (%.0f ms)' % (status, turn.index + 1, turn.entry, turn.latency * 1000))
+            if turn.error:
+                lines.append('      %s' % turn.error)
+            for failure in turn.failures:
+                lines.append('      %s' % failure)
+        return '\n'.join(lines)
+
+
+def scenario_names(scenarios):
+    """Name of each scenario; "scenario N" for the Nth one if it has none.
+
+    Results are looked up by name, so names must be unique.
+
+    :param scenarios: list of scenario dicts
+    :rtype: list of str
+    :raises ValueError: if two scenarios have the same name
+    """
+    names = [s.get('name', 'scenario %d' % (i + 1)) for i, s in enumerate(scenarios)]
+    repeated = sorted(set(name for name in names if names.count(name) > 1))
+    if repeated:
+        raise ValueError('Scenario names must be unique; repeated: %s' % ', '.join(repeated))
+    return names
+
+
+def check(response, expect):
+    """Fields of response that don't match expect.
+
+    :param response: dict | EngineResponse
+    :param expect: dict of field: expected value
+    :rtype: list of str
+    """
+    failures = []
+    for key, expected in sorted(expect.items()):
+        actual = response.get(key)
+        if isinstance(expected, basestring) and expected.startswith(REGEX_PREFIX):
+            ok = actual is not None and re.search(expected[len(REGEX_PREFIX):], unicode(actual)) is not None
+        else:
+            ok = actual == expected
+        if not ok:
+            failures.append('%s was %r; expected %r' % (key, actual, expected))
+    return failures
+
+
+def turn_params(ident, turn):
+    """Request params for a turn.
+
+    :rtype: dict
+    """
+    params = {'ident': ident, 'entry': turn.get('entry', '')}
+    if turn.get('faq'):
+        params.update(turn['faq'])
+        params['faq'] = 1
+    params.update(turn.get('params', {}))
+    return params
+
+
+def run_scenario(engine, scenario):
+    """Run a scenario's turns in order on a new session.
+
+    A turn whose request fails ends the scenario; turns that only fail their
+    expectations don't. The session is closed afterwards.
+
+    :param engine: EngineRequest
+    :param scenario: dict with name and turns
+    :rtype: ScenarioResult
+    """
+    name = scenario.get('name', 'unnamed')
+    session = engine.open_session()
+    if not session:
+        return ScenarioResult(name, None, [], session.error)
+
+    ident = session.ident
+    results = []
+    try:
+        for index, turn in enumerate(scenario.get('turns', [])):
+            params = turn_params(ident, turn)
+            start = time.time()
+            try:
+                response = engine.make_request(params)
+            except Exception, e:
+                results.append(TurnResult(index, params['entry'], time.time() - start, [], str(e)))
+                break
+            results.append(TurnResult(index, params['entry'], time.time() - start,
+                                      check(response, turn.get('expect', {})), None))
+    finally:
+        engine.close_session(ident)
+
+    return ScenarioResult(name, ident, results, None)
+
+
+def run_scenarios(engine, scenarios, concurrency=8):
+    """Run scenarios at the same time, each on its own session.
+
+    :param engine: EngineRequest
+    :param scenarios: list of scenario dicts
+    :param concurrency: max number of scenarios running at once
+    :return: a result per scenario, in the order given
+        :rtype: list of ScenarioResult
+    """
+    return run_concurrently(lambda s: run_scenario(engine, s), scenarios, concurrency)
@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import deque
+
+
+class SessionPool(object):
+    def __init__(self, engine, size=4, max_age=300):
+        """Engine sessions opened ahead of time and handed out one per test.
+
+        :param engine: EngineRequest used to open and close sessions
+            :type engine: EngineRequest
+
+        :param size: number of sessions opened, in parallel, whenever the
+        pool runs empty
+            :type size: int
+
+        :param max_age: seconds after which an unused session is treated as
+        expired by the engine and replaced
+            :type max_age: int | float
+        """
+        self.engine = engine
+        self.size = size
+        self.max_age = max_age
+
+        self._available = deque()
+        self._opened = []
+        self._lock = threading.Lock()
+
+    def fill(self):
+        """Open sessions concurrently until size sessions are available.
+
+        :return: number of sessions opened
+            :rtype: int
+        """
+        missing = self.size - len(self._available)
+        if missing <= 0:
+            return 0
+
+        results = self.engine.open_new_sessions(missing, concurrency=missing)
+        if not results.idents:
+            raise RuntimeError('Could not open engine sessions: %s' % results.failures[0].error)
+
+        opened_at = time.time()
+        for result in results:
+            if result.success:
+                self._opened.append(result.ident)
+                self._available.append((opened_at, result.response))
+
+        return len(results.idents)
+
+    def acquire(self):
+        """Return the INIT response of an unused session. Sessions are
+        never handed out twice.
+
+        :rtype: dict
+        """
+        with self._lock:
+            while True:
+                while self._available:
+                    opened_at, response = self._available.popleft()
+                    if time.time() - opened_at < self.max_age:
+                        return dict(response)
+
+                self.fill()
+
+    def close(self):
+        """End every session the pool opened, used or not.
+
+        :rtype: SessionResults
+        """
+        with self._lock:
+            idents, self._opened = self._opened, []
+            self._available.clear()
+
+        return self.engine.end_multiple_sessions(idents, concurrency=max(self.size, 1))
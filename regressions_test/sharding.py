@@ -0,0 +1,179 @@
+import json
+import os
+import time
+import pytest
+from registry import write_json
+from targets import Target
+
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DURATIONS_FILE = os.path.join(DIRECTORY, 'durations.json')
+SHARD_DIRECTORY = os.path.join(DIRECTORY, 'shards')
+
+# Seconds assumed for a test that has no stored duration, when no test has one
+DEFAULT_DURATION = 1.0
+
+
+def shard_path_for(index, count):
+    """Default partial result file of a shard.
+
+    :rtype: str
+    """
+    return os.path.join(SHARD_DIRECTORY, 'shard-%d-of-%d.json' % (index, count))
+
+
+def load_durations(path=DURATIONS_FILE):
+    """Stored seconds per test id.
+
+    :rtype: dict
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.loads(f.read())
+    except ValueError:
+        return {}
+
+
+def save_durations(durations, path=DURATIONS_FILE):
+    """Add durations to the stored ones, replacing those of the same tests.
+
+    :param durations: dict of test id: seconds
+    """
+    if not durations:
+        return
+    stored = load_durations(path)
+    stored.update(durations)
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    write_json(path, stored)
+
+
+def assign(nodeids, count, durations):
+    """Split tests into count shards of about the same total duration.
+
+    Tests are handed out longest first, each to the shard with the least
+    work so far. The split only depends on the test ids and durations, so
+    every shard computes the same one.
+
+    :param nodeids: list of test ids
+    :param count: number of shards
+    :param durations: dict of test id: seconds; tests without one count as
+    the mean stored duration
+    :return: test id: shard index
+        :rtype: dict
+    """
+    known = [durations[n] for n in nodeids if n in durations]
+    default = sum(known) / len(known) if known else DEFAULT_DURATION
+
+    loads = [0.0] * count
+    shards = {}
+    for nodeid in sorted(set(nodeids), key=lambda n: (-durations.get(n, default), n)):
+        shard = min(range(count), key=lambda i: (loads[i], i))
+        shards[nodeid] = shard
+        loads[shard] += durations.get(nodeid, default)
+    return shards
+
+
+class Shard(object):
+    """pytest plugin deselecting the tests of every other shard."""
+
+    def __init__(self, index, count, durations=None):
+        """
+        :param index: int; this shard, from 0 to count - 1
+        :param count: int; number of shards
+        :param durations: dict of test id: seconds. Defaults to the stored
+        durations; every shard must use the same ones.
+        """
+        if not 0 <= index < count:
+            raise ValueError('Shard index must be from 0 to %d; got %d' % (count - 1, index))
+        self.index = index
+        self.count = count
+        self.durations = durations if durations is not None else load_durations()
+        self.deselected = []
+
+    # Before any other deselection, which may differ between machines
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_collection_modifyitems(self, session, config, items):
+        shards = assign([item.nodeid for item in items], self.count, self.durations)
+        selected = []
+        for item in items:
+            if shards[item.nodeid] == self.index:
+                selected.append(item)
+            else:
+                self.deselected.append(item)
+
+        if self.deselected:
+            config.hook.pytest_deselected(items=self.deselected)
+            items[:] = selected
+
+    def pytest_terminal_summary(self, terminalreporter):
+        terminalreporter.write_line('Shard %d of %d: %d tests belong to other shards' % (
+            self.index, self.count, len(self.deselected)))
+
+
+def write_partial(path, index, count, rows, tests):
+    """Write the results of one shard.
+
+    :param rows: list of per target result rows, as for results.format_table
+    :param tests: dict of test id: {"outcome": str, "duration": seconds}
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    write_json(path, {'shard_index': index,
+                      'shard_count': count,
+                      'created': time.time(),
+                      'rows': rows,
+                      'tests': tests})
+
+
+def merge(paths):
+    """Combine the partial result files of a sharded run.
+
+    Every target's outcome counts and durations are added up across shards;
+    a target that couldn't be tested on any shard keeps that shard's message.
+
+    :param paths: list of partial result files
+    :return: merged rows and tests, plus a list of problems found, such as
+    missing shards or tests run by more than one shard
+        :rtype: tuple; (list, dict, list)
+    """
+    rows = {}
+    tests = {}
+    problems = []
+    counts = set()
+    indexes = set()
+
+    for path in paths:
+        with open(path, 'r') as f:
+            partial = json.loads(f.read())
+        counts.add(partial['shard_count'])
+        if partial['shard_index'] in indexes:
+            problems.append('Shard %d given more than once' % partial['shard_index'])
+        indexes.add(partial['shard_index'])
+
+        for row in partial['rows']:
+            target = Target(row['project'], row['environment'])
+            merged = rows.setdefault(target, {'project': target.project, 'environment': target.environment})
+            for key, value in row.items():
+                if key == 'message':
+                    merged['message'] = value
+                elif isinstance(value, (int, float)):
+                    merged[key] = merged.get(key, 0) + value
+
+        for nodeid, result in partial['tests'].items():
+            if nodeid in tests:
+                problems.append('%s was run by more than one shard' % nodeid)
+            tests[nodeid] = result
+
+    if len(counts) > 1:
+        problems.append('Files are from runs with different shard counts: %s' % ', '.join(map(str, sorted(counts))))
+    elif counts:
+        missing = sorted(set(range(counts.pop())) - indexes)
+        if missing:
+            problems.append('Missing shards: %s' % ', '.join(map(str, missing)))
+
+    return [rows[t] for t in sorted(rows)], tests, problems
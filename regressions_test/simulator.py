@@ -0,0 +1,297 @@
+import BaseHTTPServer
+import SocketServer
+import random
+import string
+import threading
+import time
+import urlparse
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+
+# Routes a simulated request can take
+INIT = 'init'
+ENTRY = 'entry'
+FAQ = 'faq'
+CLOSE = 'close'
+ROUTES = (INIT, ENTRY, FAQ, CLOSE)
+
+# INIT template; satisfies the INIT checks in main_tests.py
+INIT_FIELDS = OrderedDict([
+    ('answerID', '1'),
+    ('answerLinkID', '1'),
+    ('autosubmitmode', 'true'),
+    ('autosubmitwaittime', '0'),
+    ('backnavdisabled', 'true'),
+    ('backnavflag', None),
+    ('backnavtext', 'Back'),
+    ('userintent', ''),
+    ('botanswer', 'Hello, how can I help you today?'),
+    ('conditionID', '0'),
+    ('conditionLinkID', '0'),
+    ('conversationhistory', None),
+    ('currentBA', 'root'),
+    ('currentChannel', 'root'),
+    ('disableautocomplete', 'false'),
+    ('dtreenodeid', None),
+    ('dtreeobjectid', None),
+    ('entrysuggestions', '["billing", "live chat"]'),
+    ('fbresponse', None),
+    ('forcesessionclose', 'false'),
+    ('hideuserentry', 'false'),
+    ('icsappended', 'false'),
+    ('ident', None),
+    ('livechatrequested', 'false'),
+    ('livechatskill', None),
+    ('maxsemanticfaqs', '5'),
+    ('question', None),
+    ('recognitionID', '1'),
+    ('relatedlistprompttext', None),
+    ('section', 'INIT'),
+    ('sitecontext', None),
+    ('transactioncount', '1'),
+    ('userentryallowed', 'true'),
+    ('userlogid', '100000000'),
+    ('validresponse', 'CVUSAVA Status: Ok'),
+])
+
+
+def new_ident():
+    """Random 22 character session ident, like the engine's."""
+    return ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(22))
+
+
+def _element(tag, text):
+    if text is None:
+        return '<%s/>' % tag
+    return '<%s>%s</%s>' % (tag, escape(text), tag)
+
+
+def _list(tag, item_tag, items):
+    return '<%s>%s</%s>' % (tag, ''.join(
+        '<%s>%s</%s>' % (item_tag, ''.join(_element(k, v) for k, v in item.items()), item_tag)
+        for item in items), tag)
+
+
+def semantic_faqs(count):
+    return [OrderedDict([('AnswerId', str(i)),
+                         ('RecognitionId', str(i * 7)),
+                         ('QuestionText', 'How do I do thing number %d?' % i),
+                         ('subtype', 'semantic')]) for i in range(count)]
+
+
+def connectors(count):
+    return [OrderedDict([('id', str(i)), ('text', 'Option %d' % i), ('linkid', str(i))])
+            for i in range(count)]
+
+
+def disambiguation_options(count):
+    return [OrderedDict([('text', 'Did you mean %d?' % i), ('recognitionid', str(i))])
+            for i in range(count)]
+
+
+def build_response(fields=None, faqs=0, connector_count=0, options=0):
+    """Build an engine response document.
+
+    :param fields: dict of tag: text overriding the INIT template
+    :param faqs: number of semanticfaqs
+    :param connector_count: number of connectors
+    :param options: number of disambiguationoptions
+    :rtype: str
+    """
+    values = OrderedDict(INIT_FIELDS)
+    values.update(fields or {})
+
+    parts = ['<?xml version="1.0" encoding="utf-8"?><response>']
+    parts.extend(_element(tag, text) for tag, text in values.items())
+    parts.append('<faqitems><suggestedfaqlist>%s</suggestedfaqlist></faqitems>'
+                 % _list('semanticfaqs', 'faq', semantic_faqs(faqs)))
+    parts.append(_list('connectors', 'connector', connectors(connector_count)))
+    parts.append(_list('disambiguationoptions', 'option', disambiguation_options(options)))
+    parts.append('</response>')
+
+    response = ''.join(parts)
+    return response.encode('utf-8') if isinstance(response, unicode) else response
+
+
+class Route(object):
+    def __init__(self, latency=0, jitter=0, error_rate=0.0):
+        """Behaviour of one kind of simulated request.
+
+        :param latency: ms to wait before responding
+        :param jitter: ms of random extra latency, up to
+        :param error_rate: fraction of requests answered with HTTP 500
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Buffer writes; unbuffered headers interact badly with delayed acks
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        if self.server.engine.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_GET(self):
+        self._respond({})
+
+    def do_POST(self):
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length)
+        self._respond(dict(urlparse.parse_qsl(body, keep_blank_values=True)))
+
+    def _respond(self, params):
+        status, body = self.server.engine.handle(params)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+
+class SimulatedEngine(object):
+    def __init__(self, host='127.0.0.1', port=0, routes=None, semantic_faqs=5, connectors=3,
+                 disambiguation_options=0, version_number='1', live_chat_skill='general', verbose=False):
+        """Stand in engine speaking the form encoded request / xml response
+        protocol EngineRequest expects.
+
+        A request without a known ident is an INIT and opens a session;
+        sessionclosed=1 closes it with a blank response; faq=1 answers the
+        recognition_id/answer_id given; anything else answers the entry.
+        The entry "versionnumber" returns "publish_id: <version_number>" and
+        entries containing "live chat" request live chat.
+
+        :param host: str
+        :param port: int; 0 picks a free port
+        :param routes: dict of route name (INIT, ENTRY, FAQ, CLOSE): Route
+        :param semantic_faqs: related faqs returned for an entry
+        :param connectors: connectors returned for an entry
+        :param disambiguation_options: options returned for an entry
+        :param version_number: kb version reported for "versionnumber"
+        :param live_chat_skill: livechatskill returned with live chat
+        :param verbose: log every request
+        """
+        self.routes = dict((name, Route()) for name in ROUTES)
+        self.routes.update(routes or {})
+        self.semantic_faqs = semantic_faqs
+        self.connectors = connectors
+        self.disambiguation_options = disambiguation_options
+        self.version_number = str(version_number)
+        self.live_chat_skill = live_chat_skill
+        self.verbose = verbose
+
+        self.sessions = {}
+        self.counts = dict.fromkeys(ROUTES, 0)
+        self.errors = dict.fromkeys(ROUTES, 0)
+        self._lock = threading.Lock()
+
+        self._server = _Server((host, port), _Handler)
+        self._server.engine = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%s/bot.htm' % (host, port)
+
+    def _route(self, params):
+        if params.get('sessionclosed'):
+            return CLOSE
+        if params.get('ident') not in self.sessions:
+            return INIT
+        if params.get('faq'):
+            return FAQ
+        return ENTRY
+
+    def handle(self, params):
+        """Answer one request.
+
+        :param params: dict of form params
+        :rtype: tuple; (http status, body)
+        """
+        with self._lock:
+            route = self._route(params)
+            self.counts[route] += 1
+
+        settings = self.routes[route]
+        delay = settings.latency + random.uniform(0, settings.jitter)
+        if delay:
+            time.sleep(delay / 1000.0)
+
+        if settings.error_rate and random.random() < settings.error_rate:
+            with self._lock:
+                self.errors[route] += 1
+            return 500, 'Simulated engine error'
+
+        with self._lock:
+            if route == CLOSE:
+                self.sessions.pop(params.get('ident'), None)
+                return 200, ''
+
+            if route == INIT:
+                ident = new_ident()
+                self.sessions[ident] = 0
+            else:
+                ident = params['ident']
+
+            self.sessions[ident] += 1
+            transactions = self.sessions[ident]
+
+        fields = {'ident': ident,
+                  'transactioncount': str(transactions),
+                  'userlogid': str(100000000 + transactions)}
+        if route == INIT:
+            return 200, build_response(fields)
+
+        if route == FAQ:
+            fields.update({'answerID': params.get('answer_id', ''),
+                           'recognitionID': params.get('recognition_id', ''),
+                           'userintent': 'Question %s' % params.get('recognition_id', ''),
+                           'botanswer': 'Answer %s' % params.get('answer_id', '')})
+            return 200, build_response(fields)
+
+        entry = params.get('entry', '')
+        fields.update({'userintent': entry, 'section': 'Answer', 'autosubmitmode': 'false',
+                       'relatedlistprompttext': 'Here are some related items:'})
+        if entry.strip().lower() == 'versionnumber':
+            fields['botanswer'] = 'publish_id: %s' % self.version_number
+        else:
+            fields['botanswer'] = 'You said: %s' % entry
+        if 'live chat' in entry.lower():
+            fields.update({'livechatrequested': 'true', 'livechatskill': self.live_chat_skill})
+
+        return 200, build_response(fields, self.semantic_faqs, self.connectors, self.disambiguation_options)
+
+    def start(self):
+        """Serve in a background thread.
+
+        :return: the engine url
+            :rtype: str
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self.url
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {'requests': dict(self.counts), 'errors': dict(self.errors),
+                    'open_sessions': len(self.sessions)}
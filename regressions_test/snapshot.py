@@ -0,0 +1,284 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict, namedtuple
+from connection_pool import ConnectionPool
+from engine_request import EngineRequest, run_concurrently
+from scenarios import scenario_names, turn_params
+
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_DIRECTORY = os.path.join(DIRECTORY, 'snapshots')
+
+# Fields that differ on every request
+IGNORED_FIELDS = ('ident', 'userlogid', 'transactioncount')
+
+# List fields, and the item field identifying an item across versions
+LIST_FIELDS = {
+    'related_list': 'AnswerId',
+    'connectors': 'id',
+    'disambiguationoptions': 'recognitionid'
+}
+
+
+class Difference(namedtuple('Difference', 'input field change old new')):
+    """One change between two snapshots.
+
+    change is "added" or "removed" for inputs or list items only in one
+    snapshot, "changed" for values that differ and "reordered" for list
+    items in a different order.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        if self.field is None:
+            return '%s: %s' % (self.input, self.change)
+        if self.change == 'changed':
+            return '%s: %s changed: %r -> %r' % (self.input, self.field, self.old, self.new)
+        if self.change == 'reordered':
+            return '%s: %s reordered: %s -> %s' % (self.input, self.field, self.old, self.new)
+        return '%s: %s %s: %r' % (self.input, self.field, self.change,
+                                  self.new if self.change == 'added' else self.old)
+
+
+def digest(value):
+    """Short stable hash of a json serializable value.
+
+    :rtype: str
+    """
+    return hashlib.sha1(json.dumps(value, sort_keys=True)).hexdigest()[:16]
+
+
+def path_for(project, environment, version_number):
+    """Snapshot file of a project's environment at a kb version.
+
+    :rtype: str
+    """
+    directory = '%s_%s' % (project.lower().replace(' ', '_'), environment)
+    return os.path.join(SNAPSHOT_DIRECTORY, directory, '%s.json.gz' % version_number)
+
+
+def versions(project, environment):
+    """Kb versions with a snapshot, oldest snapshot first.
+
+    :rtype: list
+    """
+    directory = os.path.dirname(path_for(project, environment, 0))
+    if not os.path.isdir(directory):
+        return []
+    files = [f for f in os.listdir(directory) if f.endswith('.json.gz')]
+    files.sort(key=lambda f: os.path.getmtime(os.path.join(directory, f)))
+    return [f[:-len('.json.gz')] for f in files]
+
+
+def config_inputs(config):
+    """Conversations to snapshot, from the inputs in a project config.
+
+    :param config: dict; project config
+    :return: input name: list of turns; a turn is a dict with an entry or faq params
+        :rtype: OrderedDict
+    """
+    inputs = OrderedDict()
+
+    def add(name, entries):
+        entries = [e for e in entries if e]
+        if entries:
+            inputs[name] = [{'entry': e} for e in entries]
+
+    for key in ('semantic_input', 'dtree_input', 'disambiguation_input', 'blank_related_results_prompt_input'):
+        if isinstance(config.get(key), basestring):
+            add(key, [config[key]])
+    add('active_close_values', [config.get('active_close_values', {}).get('input')])
+    add('blank_connector_values', [config.get('blank_connector_values', {}).get('input')])
+    add('custom_back_text_values', config.get('custom_back_text_values', {}).get('inputs', []))
+    add('live_chat_values', config.get('live_chat_values', {}).get('live_chat_input', []))
+    for entry in config.get('snapshot_inputs', []):
+        add('input:%s' % entry, [entry])
+    scenarios = config.get('scenarios', [])
+    for scenario, name in zip(scenarios, scenario_names(scenarios)):
+        if scenario.get('turns'):
+            inputs['scenario:%s' % name] = scenario['turns']
+
+    return inputs
+
+
+def compact(response):
+    """Response without the fields that change on every request, with its hash.
+
+    :param response: dict; parsed response
+    :rtype: dict
+    """
+    fields = dict((k, v) for k, v in response.items() if k not in IGNORED_FIELDS)
+    return {'hash': digest(fields), 'response': fields}
+
+
+def _record(engine, turns):
+    """Run a conversation on a new session.
+
+    :return: compacted response per turn, or an error message
+        :rtype: list | str
+    """
+    session = engine.open_session()
+    if not session:
+        return 'INIT failed: %s' % session.error
+
+    responses = []
+    try:
+        for turn in turns:
+            responses.append(compact(engine.make_request(turn_params(session.ident, turn))))
+    except Exception, e:
+        return '%s: %s' % (type(e).__name__, e)
+    finally:
+        engine.close_session(session.ident)
+    return responses
+
+
+def take(endpoint, config, concurrency=8):
+    """Record the response to every config input.
+
+    Multi turn inputs are stored per turn as "<input>#<turn>".
+
+    :param endpoint: str; engine url
+    :param config: dict; project config
+    :param concurrency: number of conversations run at once
+    :return: responses by input name, and errors by input name
+        :rtype: tuple; (dict, dict)
+    """
+    engine = EngineRequest(endpoint, project=config.get('name'), pool=ConnectionPool(maxsize=concurrency))
+    inputs = config_inputs(config)
+    names = list(inputs)
+    recorded = run_concurrently(lambda name: _record(engine, inputs[name]), names, concurrency)
+    engine.pool.close()
+
+    responses, errors = {}, {}
+    for name, result in zip(names, recorded):
+        if isinstance(result, basestring):
+            errors[name] = result
+        elif len(result) == 1:
+            responses[name] = result[0]
+        else:
+            for turn, response in enumerate(result):
+                responses['%s#%d' % (name, turn + 1)] = response
+    return responses, errors
+
+
+def save(path, project, environment, version_number, responses):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    payload = json.dumps({'project': project,
+                          'environment': environment,
+                          'version_number': version_number,
+                          'created': time.time(),
+                          'responses': responses}, separators=(',', ':'), sort_keys=True)
+    tmp = '%s.tmp' % path
+    with gzip.open(tmp, 'wb') as f:
+        f.write(payload)
+    os.rename(tmp, path)
+
+
+def load(path):
+    """Responses of a snapshot file.
+
+    :rtype: dict
+    """
+    with gzip.open(path, 'rb') as f:
+        return json.loads(f.read())['responses']
+
+
+def _keyed(items, key):
+    """True if every item has a distinct value for key."""
+    ids = [item.get(key) if isinstance(item, dict) else None for item in items]
+    return None not in ids and len(set(map(json.dumps, ids))) == len(ids)
+
+
+def _diff_items(name, label, before, after):
+    """Differences between two list items, field by field when both are dicts."""
+    if not isinstance(before, dict) or not isinstance(after, dict):
+        return [Difference(name, label, 'changed', before, after)]
+    return [Difference(name, '%s.%s' % (label, sub), 'changed', before.get(sub), after.get(sub))
+            for sub in sorted(set(before) | set(after)) if before.get(sub) != after.get(sub)]
+
+
+def _diff_by_index(name, field, old, new):
+    differences = []
+    for i in range(max(len(old), len(new))):
+        if i >= len(new):
+            differences.append(Difference(name, field, 'removed', old[i], None))
+        elif i >= len(old):
+            differences.append(Difference(name, field, 'added', None, new[i]))
+        elif old[i] != new[i]:
+            differences.extend(_diff_items(name, '%s[%d]' % (field, i), old[i], new[i]))
+    return differences
+
+
+def _diff_list(name, field, old, new):
+    """Differences between two versions of a list field. Items are matched
+    by their LIST_FIELDS key, or by position when an item has no key or
+    two items share one."""
+    key = LIST_FIELDS[field]
+    old, new = old or [], new or []
+    if not (_keyed(old, key) and _keyed(new, key)):
+        return _diff_by_index(name, field, old, new)
+
+    old_items = OrderedDict((item.get(key), item) for item in old)
+    new_items = OrderedDict((item.get(key), item) for item in new)
+
+    differences = []
+    for item_id, item in old_items.items():
+        if item_id not in new_items:
+            differences.append(Difference(name, field, 'removed', item, None))
+    for item_id, item in new_items.items():
+        if item_id not in old_items:
+            differences.append(Difference(name, field, 'added', None, item))
+            continue
+        before = old_items[item_id]
+        if before != item:
+            differences.extend(_diff_items(name, '%s[%s=%s]' % (field, key, item_id), before, item))
+
+    kept_old = [i for i in old_items if i in new_items]
+    kept_new = [i for i in new_items if i in old_items]
+    if kept_old != kept_new:
+        differences.append(Difference(name, field, 'reordered', kept_old, kept_new))
+    return differences
+
+
+def diff(old, new):
+    """Differences between two snapshots' responses.
+
+    Responses whose hashes match are skipped without looking at their
+    fields, so mostly unchanged snapshots diff quickly. Responses whose
+    hashes differ always have at least one Difference.
+
+    :param old: dict; responses by input name
+    :param new: dict; responses by input name
+    :rtype: list of Difference
+    """
+    differences = []
+    for name in sorted(set(old) | set(new)):
+        if name not in new:
+            differences.append(Difference(name, None, 'removed', None, None))
+            continue
+        if name not in old:
+            differences.append(Difference(name, None, 'added', None, None))
+            continue
+        if old[name]['hash'] == new[name]['hash']:
+            continue
+
+        before, after = old[name]['response'], new[name]['response']
+        found = []
+        for field in sorted(set(before) | set(after)):
+            if before.get(field) == after.get(field):
+                continue
+            if field in LIST_FIELDS:
+                found.extend(_diff_list(name, field, before.get(field), after.get(field)))
+            else:
+                found.append(Difference(name, field, 'changed', before.get(field), after.get(field)))
+        if not found:
+            # Shouldn't happen; report the change rather than hide it
+            found.append(Difference(name, 'hash', 'changed', old[name]['hash'], new[name]['hash']))
+        differences.extend(found)
+    return differences
@@ -0,0 +1,54 @@
+import math
+
+
+def percentile(values, pct):
+    """Nearest rank percentile.
+
+    :param values: list of numbers
+    :param pct: float; 0-100
+    :rtype: float | None; None if values is empty
+    """
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+
+
+def summarize(values):
+    """Count, mean, p50/p95/p99 and max of values.
+
+    :param values: list of numbers
+    :rtype: dict
+    """
+    if not values:
+        return {'count': 0, 'mean': None, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+
+    ordered = sorted(values)
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / float(len(ordered)),
+        'p50': percentile(ordered, 50),
+        'p95': percentile(ordered, 95),
+        'p99': percentile(ordered, 99),
+        'max': ordered[-1]
+    }
+
+
+def format_ms(seconds):
+    """Seconds as milliseconds for a report; '-' for None.
+
+    :rtype: str
+    """
+    return '-' if seconds is None else '%.1f' % (seconds * 1000)
+
+
+def table_lines(rows):
+    """Left aligned columns of a plain text table, header row included.
+
+    :param rows: list of lists of str, all the same length
+    :rtype: list of str
+    """
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return ['  '.join(cell.ljust(w) for cell, w in zip(row, widths)).rstrip() for row in rows]
@@ -0,0 +1,69 @@
+import os
+from collections import namedtuple
+
+
+class Target(namedtuple('Target', 'project environment')):
+    """A project's environment tests run against."""
+    __slots__ = ()
+
+    @property
+    def id(self):
+        """Test id of the target, as in main_tests.py::test_semantic[altice-production]"""
+        return '%s-%s' % (self.project.lower().replace(' ', '_'), self.environment)
+
+    def __str__(self):
+        return '%s: %s' % (self.project, self.environment)
+
+
+def parse_target(value):
+    """Target from a "PROJECT:ENVIRONMENT" string.
+
+    :rtype: Target
+    """
+    project, sep, environment = value.rpartition(':')
+    if not sep or not project or not environment:
+        raise ValueError('Expected PROJECT:ENVIRONMENT, got: %s' % value)
+    return Target(project, environment)
+
+
+def targets_for(config):
+    """Targets of a pytest run, from --target options, or --project and
+    --environment for a single target.
+
+    :param config: pytest config
+    :rtype: list of Target
+    """
+    targets = [parse_target(t) for t in config.getoption('target') or []]
+    if not targets and config.getoption('project') and config.getoption('environment'):
+        targets = [Target(config.getoption('project'), config.getoption('environment'))]
+    return targets
+
+
+def applies_to(path, project):
+    """True if the tests in a file run against project. Custom test files
+    run against the projects named in the file name only; any other test
+    file runs against every project.
+
+    :param path: str; test file
+    :param project: str; project name
+    :rtype: bool
+    """
+    name = os.path.splitext(os.path.basename(path))[0].lower()
+    if not name.endswith('_custom_test'):
+        return True
+    return project.lower() in name
+
+
+def target_of(nodeid, targets):
+    """Target a test id belongs to, or None.
+
+    :param nodeid: str; pytest node id
+    :param targets: list of Target
+    :rtype: Target | None
+    """
+    if not nodeid.endswith(']'):
+        return None
+    param = nodeid[nodeid.find('[', nodeid.rfind('.py::')) + 1:-1]
+    # The longest matching id, in case one target's id starts with another's
+    matches = [t for t in targets if param == t.id or param.startswith(t.id + '-')]
+    return max(matches, key=lambda t: len(t.id)) if matches else None
@@ -4,11 +4,6 @@ Custom tests for Altice project
 from pytest import fixture
 
 
-@fixture
-def session(engine):
-    return engine.make_request()
-
-
 @fixture
 def custom_vars(project_config):
     return project_config['custom']
@@ -54,6 +49,6 @@ def test_shortened_related_result_text(engine, session, custom_vars):
         'answer_id': ans_id,
         'faq': 1
     })
-    faq_res = engine.make_request(params=params)
+    faq_res = engine.make_request(params=params, cache=True)
 
     assert faq.get('QuestionText') != faq_res.get('userintent')
\ No newline at end of file
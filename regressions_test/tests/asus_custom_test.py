@@ -1,13 +1,6 @@
 """
 Custom tests for Asus project
 """
-from pytest import fixture
-
-
-
-@fixture
-def session(engine):
-    return engine.make_request()
 
 # Deprecated 6/15/2018
 # def test_top_semantic_answer(engine, session, project_config):
@@ -1,9 +1,3 @@
 """
 Custom tests for Asus project
 """
-from pytest import fixture
-
-
-@fixture
-def session(engine):
-    return engine.make_request()
\ No newline at end of file
@@ -86,6 +86,7 @@ def test_semantic(semantic_input, params, engine):
 
 
 def test_versionnumber(version_number, params, engine):
+    # Never cached; this checks the kb version the engine serves right now
     params['entry'] = 'versionnumber'
     r = engine.make_request(params)
 
@@ -140,3 +141,16 @@ def test_related_results_prompt(engine, params, related_results_prompt, semantic
 
     assert r.get('relatedlistprompttext') == related_results_prompt, \
         'Session id: %s || Res. Session id: %s' % (session.get('ident'), r.get('ident'))
+
+
+def test_scenario(scenario, scenario_results):
+    """
+    Check every turn of a conversation scenario from the project config.
+    :param scenario: scenario name
+    :param scenario_results: dict; ScenarioResult by scenario name
+    :return:
+    """
+    if scenario is None: pytest.skip('No scenarios found in config.')
+    result = scenario_results[scenario]
+    print result.report()
+    assert result.passed, result.report()
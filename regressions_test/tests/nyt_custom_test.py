@@ -1,12 +1,6 @@
 """
 Custom tests for Asus project
 """
-from pytest import fixture
-
-
-@fixture
-def session(engine):
-    return engine.make_request()
 
 
 def test_disambiguation(engine, session, project_config):
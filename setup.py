@@ -16,7 +16,8 @@ setup(
     name='regressions_test',
     version=version,
     packages=['regressions_test'],
-    install_requires=['pytest'],
+    # pytest-xdist runs the endpoints of test -p in parallel worker processes
+    install_requires=['pytest', 'pytest-xdist>=1.20'],
     scripts=['bin/regressions_test'],
     entry_points={
         'console_scripts': ['regressions_test = regressions_test.regressions_test:main']